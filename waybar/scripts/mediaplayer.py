@@ -1,54 +1,438 @@
 #!/usr/bin/env python3
-from gi.repository import Playerctl, GLib
 import argparse
+import fcntl
+import html
 import logging
+import os
+import socket
+import subprocess
 import sys
 import signal
-import gi
+import time
 import json
-gi.require_version('Playerctl', '2.0')
+
+# Imported by load_gi(); the --subscribe client never needs them
+GLib = Playerctl = None
 
 logger = logging.getLogger(__name__)
 
 
-def write_output(text, player, mode):
-    logger.info('Writing output')
+def load_gi():
+    global GLib, Playerctl
+    import gi
+    gi.require_version('Playerctl', '2.0')
+    from gi.repository import Playerctl, GLib
+
+
+def clock(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes >= 60:
+        return '{}:{:02}:{:02}'.format(minutes // 60, minutes % 60, seconds)
+    return '{}:{:02}'.format(minutes, seconds)
 
-    if mode == 'paused':
-        output = {'text': text,
-                  'class': 'paused',
-                  'alt': player.props.player_name}
-    else:
-        output = {'text': text,
-                  'class': 'playing',
-                  'alt': player.props.player_name}
 
-    sys.stdout.write(json.dumps(output) + '\n')
+def add_progress(payload, track):
+    """Add percentage and elapsed/total when --progress is on and the length is known"""
+    elapsed = track.get('elapsed')
+    if elapsed is None:
+        return payload
+    payload['percentage'] = int(100 * elapsed / track['length'])
+    if 'tooltip' in payload:
+        payload['tooltip'] += ' ({elapsed} / {length})'.format(
+            elapsed=clock(elapsed), length=clock(track['length']))
+    return payload
+
+
+def format_default(track):
+    """Single-line format of the standalone mode"""
+    if track is None:
+        return None
+    if track['status'] != 'Playing' and track['text']:
+        mode = 'paused'
+    else:
+        mode = 'playing'
+    return add_progress({'text': track['text'],
+                         'class': mode,
+                         'alt': track['player']}, track)
+
+
+def format_icon(track):
+    """Status-only format for the play/pause icon module"""
+    if track is None:
+        return None
+    return {'text': track['status'],
+            'tooltip': '{player} : {title}'.format(
+                player=track['player'], title=html.escape(track['title'], quote=False)),
+            'alt': track['status'],
+            'class': track['status']}
+
+
+def format_label(track):
+    """'artist - title' format for the label module"""
+    if track is None:
+        return None
+    title = html.escape(track['title'], quote=False)
+    return add_progress({'text': '{artist} - {title}'.format(
+                             artist=html.escape(track['artist'], quote=False), title=title),
+                         'tooltip': '{player} : {title}'.format(player=track['player'], title=title),
+                         'alt': track['status'],
+                         'class': track['status']}, track)
+
+
+FORMATS = {'default': format_default,
+           'icon': format_icon,
+           'label': format_label}
+
+
+def write_stdout(line):
+    sys.stdout.write(line + '\n')
     sys.stdout.flush()
 
 
+class Output:
+    """Coalescing, deduplicating writer for one format.
+
+    Tracks handed to emit() within `window_ms` of each other are merged
+    into one write on the GLib loop; the track is formatted once per burst
+    and a payload equal to the last one written is dropped.
+    """
+
+    def __init__(self, write=write_stdout, fmt=format_default, window_ms=50):
+        self.write = write
+        self.format = fmt
+        self.window_ms = window_ms
+        self.last = None
+        self.line = None
+        self.pending = None
+        self.source_id = None
+
+    def emit(self, track):
+        # None stands for an empty line (no player)
+        self.pending = track
+        if self.window_ms <= 0:
+            self.flush()
+        elif self.source_id is None:
+            self.source_id = GLib.timeout_add(self.window_ms, self.flush)
+
+    def flush(self):
+        self.source_id = None
+        payload = self.format(self.pending)
+        if payload == self.last and self.line is not None:
+            logger.debug('Output unchanged, skipping')
+            return False
+        logger.info('Writing output')
+        self.last = payload
+        self.line = json.dumps(payload) if payload is not None else ''
+        self.write(self.line)
+        return False
+
+    def close(self):
+        self.write('')
+
+
+class Subscriber:
+    """One connected --subscribe client"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.format = None     # set once the client has sent its format name
+        self.inbox = b''
+        self.outbox = b''      # lines the socket has not taken yet
+        self.watch = None      # IO_IN watch
+        self.out_watch = None  # IO_OUT watch, only while outbox is not empty
+
+
+class Daemon:
+    """Single shared watcher publishing every format over a Unix socket.
+
+    A subscriber connects, sends the name of a format on one line and then
+    receives that format's JSON lines, starting with the current one.
+    Sockets are non-blocking: whatever a client does not take right away
+    waits in its outbox and is drained when the socket becomes writable.
+    """
+
+    # A client this far behind is not reading at all: drop it
+    MAX_BACKLOG = 64 * 1024
+
+    def __init__(self, path, window_ms=50):
+        self.path = path
+        self.outputs = {name: Output(lambda line, name=name: self.broadcast(name, line),
+                                     fmt, window_ms)
+                        for name, fmt in FORMATS.items()}
+        self.clients = {}    # socket -> Subscriber
+        self.lock = None
+        self.server = None
+
+    def start(self):
+        """Take the instance lock and listen; False if a daemon already runs"""
+        self.lock = open(self.path + '.lock', 'w')
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info('Daemon already running on {path}'.format(path=self.path))
+            return False
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(8)
+        self.server.setblocking(False)
+        GLib.io_add_watch(self.server.fileno(), GLib.PRIORITY_DEFAULT,
+                          GLib.IO_IN, self.on_accept)
+        logger.debug('Listening on {path}'.format(path=self.path))
+        return True
+
+    def emit(self, track):
+        for output in self.outputs.values():
+            output.emit(track)
+
+    def on_accept(self, fd, condition):
+        try:
+            conn, _ = self.server.accept()
+        except BlockingIOError:
+            return True
+        conn.setblocking(False)
+        client = Subscriber(conn)
+        client.watch = GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT,
+                                         GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR,
+                                         self.on_client, conn)
+        self.clients[conn] = client
+        return True
+
+    def on_client(self, fd, condition, conn):
+        client = self.clients.get(conn)
+        if client is None:
+            return False
+        try:
+            data = conn.recv(256)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b''
+        if not data:
+            self.drop(conn)
+            return False
+        if client.format is not None:
+            return True
+        client.inbox += data
+        if b'\n' not in client.inbox:
+            return True
+        name = client.inbox.split(b'\n', 1)[0].decode(errors='replace').strip()
+        if name not in self.outputs:
+            logger.warning('Unknown format requested: {name}'.format(name=name))
+            self.drop(conn)
+            return False
+        logger.info('New {name} subscriber'.format(name=name))
+        client.format = name
+        client.inbox = b''
+        line = self.outputs[name].line
+        if line is not None:
+            self.send(conn, line)
+        return conn in self.clients
+
+    def broadcast(self, name, line):
+        for conn, client in list(self.clients.items()):
+            if client.format == name:
+                self.send(conn, line)
+
+    def send(self, conn, line):
+        client = self.clients[conn]
+        client.outbox += (line + '\n').encode()
+        if len(client.outbox) > self.MAX_BACKLOG:
+            logger.warning('Subscriber is not reading, dropping it')
+            self.drop(conn)
+        elif client.out_watch is None:
+            self.flush(conn)
+
+    def flush(self, conn):
+        """Write what the socket takes of the outbox; True while some is left"""
+        client = self.clients[conn]
+        try:
+            sent = conn.send(client.outbox, socket.MSG_NOSIGNAL)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            # Gone: the next connect gets a fresh line
+            self.drop(conn)
+            return False
+        client.outbox = client.outbox[sent:]
+        if client.outbox and client.out_watch is None:
+            client.out_watch = GLib.io_add_watch(conn.fileno(), GLib.PRIORITY_DEFAULT,
+                                                 GLib.IO_OUT, self.on_writable, conn)
+        return bool(client.outbox)
+
+    def on_writable(self, fd, condition, conn):
+        client = self.clients.get(conn)
+        if client is None:
+            return False
+        if self.flush(conn):
+            return True
+        client.out_watch = None
+        return False
+
+    def drop(self, conn):
+        client = self.clients.pop(conn, None)
+        if client is None:
+            return
+        for watch in (client.watch, client.out_watch):
+            if watch is not None:
+                GLib.source_remove(watch)
+        conn.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class Players:
+    """State of every managed player and the choice of which one to show.
+
+    Entries are the track dicts handed to the formatters, plus the time the
+    player last became active (started playing, or changed track while
+    playing). With no priority list the most recently active playing player
+    wins, falling back to the most recently active one; with a list, only
+    the listed players are shown, playing before paused, in list order.
+    Paused players' signals never move `active`, so the choice is stable.
+
+    With a progress interval, the position is kept as an anchor (seconds
+    at a monotonic timestamp) moved only by Seeked, status and track
+    changes, and extrapolated locally; a timer re-emits the shown player
+    every `interval` seconds while it plays and stops otherwise.
+    """
+
+    def __init__(self, priority=None, interval=0):
+        self.priority = priority
+        self.interval = interval
+        self.states = {}
+        self.selected = None
+        self.tick_id = None
+
+    def rank(self, key):
+        state = self.states[key]
+        playing = state['status'] == 'Playing'
+        if self.priority is None:
+            return (playing, state['active'])
+        return (playing, -self.priority.index(state['player']), state['active'])
+
+    def choose(self):
+        keys = [key for key, state in self.states.items()
+                if self.priority is None or state['player'] in self.priority]
+        return max(keys, key=self.rank, default=None)
+
+    def position(self, state):
+        """Playback position in seconds, extrapolated from the last anchor"""
+        position = state['position']
+        if state['status'] == 'Playing':
+            position += time.monotonic() - state['anchor']
+        return position
+
+    def update(self, key, **changes):
+        now = time.monotonic()
+        state = self.states.setdefault(key, {'status': 'Stopped', 'active': 0.0,
+                                             'position': 0.0, 'anchor': now})
+        playing = changes.get('status', state['status']) == 'Playing'
+        new_track = 'track' in changes and (
+            changes['track'] != state.get('track') or
+            # Same track again after it ran out: repeat-one restarted it
+            (state.get('length') and self.position(state) >= state['length']))
+        if playing and (state['status'] != 'Playing' or new_track):
+            state['active'] = now
+        if 'position' in changes or new_track:
+            state['position'] = changes.pop('position', 0.0)
+            state['anchor'] = now
+        elif changes.get('status', state['status']) != state['status']:
+            state['position'] = self.position(state)
+            state['anchor'] = now
+        state.update(changes)
+        self.refresh(changed=key)
+
+    def remove(self, key):
+        if self.states.pop(key, None) is not None:
+            self.refresh()
+
+    def snapshot(self, key):
+        state = self.states[key]
+        if not self.interval or not state.get('length'):
+            return state
+        return dict(state, elapsed=min(max(self.position(state), 0.0), state['length']))
+
+    def refresh(self, changed=None):
+        selected = self.choose()
+        if selected == self.selected and changed != selected:
+            return
+        if selected != self.selected:
+            logger.info('Showing player: {player}'.format(player=selected))
+        self.selected = selected
+        output.emit(self.snapshot(selected) if selected is not None else None)
+        self.schedule()
+
+    def schedule(self):
+        """Run the progress timer only while the shown player plays a track of known length"""
+        state = self.states.get(self.selected)
+        wanted = bool(self.interval and state is not None and
+                      state['status'] == 'Playing' and state.get('length'))
+        if wanted and self.tick_id is None:
+            self.tick_id = GLib.timeout_add_seconds(self.interval, self.tick)
+        elif not wanted and self.tick_id is not None:
+            GLib.source_remove(self.tick_id)
+            self.tick_id = None
+
+    def tick(self):
+        # schedule() removes this source as soon as it is no longer wanted
+        output.emit(self.snapshot(self.selected))
+        return True
+
+
+output = Output()
+players = Players()
+
+
 def on_play(player, status, manager):
     logger.info('Received new playback status')
-    on_metadata(player, player.props.metadata, manager)
+    players.update(player.props.player_instance,
+                   status=status.value_nick.capitalize())
 
 
-def on_metadata(player, metadata, manager):
-    logger.info('Received new metadata')
-    track_info = ''
+def unpack_metadata(name, metadata):
+    """Turn the MPRIS metadata a{sv} into the plain track fields we format"""
+    values = metadata.unpack() if metadata is not None else {}
+    artist = values.get('xesam:artist') or ''
+    if not isinstance(artist, str):
+        artist = ', '.join(artist)
+    title = values.get('xesam:title') or ''
 
-    if player.props.player_name == 'spotify' and \
-            'mpris:trackid' in metadata.keys() and \
-            ':ad:' in player.props.metadata['mpris:trackid']:
+    if name == 'spotify' and ':ad:' in values.get('mpris:trackid', ''):
         track_info = 'AD PLAYING'
-    elif player.get_artist() != '' and player.get_title() != '':
-        track_info = '{title}'.format(title=player.get_title())
     else:
-        track_info = player.get_title()
+        track_info = title
+
+    return {'artist': artist,
+            'title': title,
+            'text': track_info,
+            # Identity of the track: same-titled tracks differ by trackid;
+            # fall back to the title for players that don't send one
+            'track': values.get('mpris:trackid') or ('title', title),
+            'length': values.get('mpris:length', 0) / 1e6}
+
+
+def on_metadata(player, metadata, manager):
+    logger.info('Received new metadata')
+    # Everything comes from the variant the signal carries: no property
+    # reads, so no D-Bus round trips per event
+    name = player.props.player_name
+    players.update(player.props.player_instance, player=name,
+                   **unpack_metadata(name, metadata))
 
-    if player.props.status != 'Playing' and track_info:
-        write_output(track_info, player, 'paused')
-    else:
-        write_output(track_info, player, 'playing')
+
+def on_seeked(player, position, manager):
+    logger.info('Received seek')
+    players.update(player.props.player_instance, position=position / 1e6)
 
 
 def on_player_appeared(manager, player, selected_player=None):
@@ -61,8 +445,7 @@ def on_player_appeared(manager, player, selected_player=None):
 
 def on_player_vanished(manager, player):
     logger.info('Player has vanished')
-    sys.stdout.write('\n')
-    sys.stdout.flush()
+    players.remove(player.props.player_instance)
 
 
 def init_player(manager, name):
@@ -72,16 +455,71 @@ def init_player(manager, name):
     player.connect('metadata', on_metadata, manager)
     manager.manage_player(player)
     on_metadata(player, player.props.metadata, manager)
+    players.update(player.props.player_instance, status=player.props.status)
+    if players.interval:
+        # The one Position read per player; Seeked keeps it in sync after that
+        player.connect('seeked', on_seeked, manager)
+        players.update(player.props.player_instance, position=player.props.position / 1e6)
 
 
 def signal_handler(sig, frame):
     logger.debug('Received signal to stop, exiting')
-    sys.stdout.write('\n')
-    sys.stdout.flush()
+    output.close()
     # loop.quit()
     sys.exit(0)
 
 
+def default_socket():
+    runtime = os.environ.get('XDG_RUNTIME_DIR') or '/tmp'
+    return os.path.join(runtime, 'waybar-mediaplayer.sock')
+
+
+def spawn_daemon(arguments):
+    logger.debug('Starting daemon on {path}'.format(path=arguments.socket))
+    command = [sys.executable, os.path.abspath(__file__), '--daemon',
+               '--socket', arguments.socket, '--coalesce', str(arguments.coalesce)]
+    if arguments.player is not None:
+        command += ['--player', arguments.player]
+    if arguments.priority is not None:
+        command += ['--priority', ','.join(arguments.priority)]
+    if arguments.progress:
+        command += ['--progress', str(arguments.progress)]
+    subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     start_new_session=True)
+
+
+def connect(arguments):
+    """Connect to the daemon, starting it if nobody is listening"""
+    for attempt in range(30):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(arguments.socket)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if attempt == 0:
+                spawn_daemon(arguments)
+            time.sleep(0.1)
+    return None
+
+
+def subscribe(arguments):
+    """Tiny client waybar execs: relay one format from the daemon to stdout"""
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    while True:
+        sock = connect(arguments)
+        if sock is not None:
+            with sock, sock.makefile('r') as lines:
+                sock.sendall((arguments.subscribe + '\n').encode())
+                for line in lines:
+                    sys.stdout.write(line)
+                    sys.stdout.flush()
+        # Daemon gone: blank the module, then reconnect (and respawn it)
+        write_stdout('')
+        time.sleep(1)
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser()
 
@@ -91,10 +529,27 @@ def parse_arguments():
     # Define for which player we're listening
     parser.add_argument('--player')
 
+    # Comma-separated player names to show, highest priority first
+    # (default: the most recently playing player)
+    parser.add_argument('--priority', type=lambda names: names.split(','))
+
+    # Add track progress, refreshed every SECONDS while playing (0: off)
+    parser.add_argument('--progress', type=int, default=0, metavar='SECONDS')
+
+    # Merge updates arriving within this many milliseconds into one line
+    parser.add_argument('--coalesce', type=int, default=50, metavar='MS')
+
+    # Shared watcher serving every waybar module, and the client for it
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--daemon', action='store_true')
+    mode.add_argument('--subscribe', choices=sorted(FORMATS), metavar='FORMAT')
+    parser.add_argument('--socket', default=default_socket())
+
     return parser.parse_args()
 
 
 def main():
+    global output
     arguments = parse_arguments()
 
     # Initialize logging
@@ -108,6 +563,21 @@ def main():
     # Log the sent command line arguments
     logger.debug('Arguments received {}'.format(vars(arguments)))
 
+    if arguments.subscribe:
+        subscribe(arguments)
+        return
+
+    load_gi()
+    players.priority = arguments.priority
+    players.interval = max(arguments.progress, 0)
+
+    if arguments.daemon:
+        output = Daemon(arguments.socket, arguments.coalesce)
+        if not output.start():
+            return
+    else:
+        output.window_ms = arguments.coalesce
+
     manager = Playerctl.PlayerManager()
     loop = GLib.MainLoop()
 
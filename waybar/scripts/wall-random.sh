@@ -8,7 +8,13 @@ if [ "${#files[@]}" -eq 0 ]; then
 fi
 idx=$(( RANDOM % ${#files[@]} ))
 file="${files[$idx]}"
-if command -v swww >/dev/null 2>&1; then
+PICKER="$(dirname "$0")/wallpicker.py"
+if command -v swww >/dev/null 2>&1 && [ -f "$PICKER" ] &&
+   python3 "$PICKER" -q --apply "$file"; then
+  # Bản scale sẵn đúng độ phân giải từng màn hình (cache trong ~/.cache/wallpicker/renditions)
+  :
+elif command -v swww >/dev/null 2>&1; then
+  # Không có picker hoặc --apply lỗi: đặt thẳng bằng swww như trước
   pgrep -x swww-daemon >/dev/null 2>&1 || swww init
   swww img "$file" --transition-type any --transition-duration 0.5 --resize crop
 elif command -v hyprctl >/dev/null 2>&1; then
@@ -19,4 +25,4 @@ elif command -v hyprctl >/dev/null 2>&1; then
 else
   notify-send "Random wallpaper" "Không tìm thấy swww hoặc hyprpaper"; exit 1
 fi
-notify-send "Wallpaper updated" "$(basename "$file)"
+notify-send "Wallpaper updated" "$(basename "$file")"
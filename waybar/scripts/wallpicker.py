@@ -1,410 +1,1613 @@
 #!/usr/bin/python3
-import os, math, subprocess, sys, threading, time
+import os, math, subprocess, sys, threading, time, hashlib, heapq, itertools, json, bisect, argparse, signal, fcntl, mmap, socket
+START = time.monotonic()   # mốc cho --profile, lấy trước khi import gi
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context, shared_memory
 
 import gi
 gi.require_version("Gtk", "4.0")
 gi.require_version("GdkPixbuf", "2.0")
-from gi.repository import Gtk, Gdk, GdkPixbuf, cairo, GLib
-
-# ---- CSS: nền trong suốt ----
-provider = Gtk.CssProvider()
-provider.load_from_data(b"""
-window, .background { background-color: transparent; }
-""")
-Gtk.StyleContext.add_provider_for_display(
-    Gdk.Display.get_default(),
-    provider,
-    Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
-)
-
+from gi.repository import Gtk, Gdk, GdkPixbuf, GLib, Gio
+import cairo
+try:
+    import numpy as np   # tuỳ chọn: chỉ cần cho chế độ ẩn ảnh trùng / theo màu
+except ImportError:
+    np = None
+
+# ---- Tracing ----
+class Tracer:
+    """Log tiến trình (tắt bằng --quiet) và số liệu --profile (mốc khởi động, thời gian decode/vẽ) in JSON ra stderr"""
+    def __init__(self):
+        self.verbose = True
+        self.profile = False
+        self.phases = {}    # tên mốc -> ms kể từ START
+        self.spans = {}     # tên -> list ms
+        self.events = []
+        self.lock = threading.Lock()
+
+    def now_ms(self):
+        return (time.monotonic() - START) * 1000
+
+    def event(self, name, msg=None, **fields):
+        """Một sự kiện có cấu trúc; msg là dòng log cho người đọc"""
+        if self.verbose and msg:
+            print(f"[wallpicker] {msg}", flush=True)
+        if self.profile:
+            with self.lock:
+                self.events.append({"t_ms": round(self.now_ms(), 2), "event": name, **fields})
+
+    def mark(self, phase):
+        """Ghi mốc khởi động (chỉ lần đầu)"""
+        if self.profile and phase not in self.phases:
+            self.phases[phase] = round(self.now_ms(), 2)
+
+    @contextmanager
+    def span(self, name):
+        if not self.profile:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            ms = (time.perf_counter() - t) * 1000
+            with self.lock:
+                self.spans.setdefault(name, []).append(ms)
+
+    def summary(self):
+        spans = {}
+        for name, values in self.spans.items():
+            v = sorted(values)
+            spans[name] = {
+                "count": len(v),
+                "total_ms": round(sum(v), 2),
+                "mean_ms": round(sum(v) / len(v), 3),
+                "p50_ms": round(v[len(v) // 2], 3),
+                "p95_ms": round(v[min(len(v) - 1, int(len(v) * 0.95))], 3),
+                "max_ms": round(v[-1], 3),
+            }
+        return {"phases": self.phases, "spans": spans, "events": self.events}
+
+    def dump(self):
+        if self.profile:
+            print(json.dumps(self.summary(), indent=2), file=sys.stderr)
+
+TRACE = Tracer()
+TRACE.profile = "--profile" in sys.argv   # bật sớm để đo được cả import
+TRACE.mark("imports")
 
 # ---- Config ----
 WALL_DIR = Path(os.environ.get("WALL_DIR", str(Path.home() / "Pictures/.wallpapers")))
 SIZE = 900   # kích thước cửa sổ (vuông)
 INNER_HOLE_RATIO = 0.25   # 0 = full pie; 0.18 = có lỗ ở giữa
 BG_ALPHA = 0.55             # độ mờ nền vòng
+PAGE_SIZE = int(os.environ.get("WALLPICKER_SECTORS", "6"))   # số miếng của vòng trong cùng (= số ảnh mỗi trang khi 1 vòng)
+RINGS = int(os.environ.get("WALLPICKER_RINGS", "1"))   # số vòng đồng tâm mỗi trang
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME", str(Path.home() / ".cache"))) / "wallpicker"
+THUMB_CACHE_MB = int(os.environ.get("WALLPICKER_CACHE_MB", "256"))   # giới hạn dung lượng cache thumbnail
+WARM_BYTES_PER_PIXEL = 0.4   # ước lượng cỡ thumbnail JPEG (cover, q90) khi cache còn trống
+MEM_CACHE_MB = int(os.environ.get("WALLPICKER_MEM_MB", "128"))   # giới hạn RAM cho pixbuf đã decode
+DECODE_BACKEND = os.environ.get("WALLPICKER_BACKEND", "thread")   # "thread" | "process" (process pool theo số core)
+THUMB_MODE = os.environ.get("WALLPICKER_THUMB_MODE", "sector")   # "sector" = vừa bbox của miếng, "canvas" = cover cả SIZE
+RENDITION_CACHE_MB = int(os.environ.get("WALLPICKER_RENDITION_MB", "512"))   # bản scale sẵn theo màn hình
+HYPRCTL = os.environ.get("HYPRCTL", "hyprctl")   # đổi sang script giả để test khi không chạy Hyprland
+PREVIEW_CHUNK = 256 * 1024   # đọc file preview theo từng đoạn để huỷ được giữa chừng
+PREVIEW_REFRESH_S = 0.08     # khoảng cách tối thiểu giữa hai lần cập nhật preview đang decode
+ATLAS_MB = int(os.environ.get("WALLPICKER_ATLAS_MB", "512"))   # dung lượng atlas tile thô cho mỗi cỡ thumbnail, 0 = tắt
 
 # ---- Utils ----
+class WallIndex:
+    """Index thư mục ảnh lưu trong cache; lần sau chỉ quét lại thư mục có mtime thay đổi.
+
+    walk() duyệt DFS, con trong mỗi thư mục sắp theo tên, nên ảnh ra đúng thứ tự của
+    sorted(paths) và có thể stream dần mà không cần chờ quét xong cả cây.
+    Lưu ý: ghi đè file tại chỗ không đổi mtime thư mục, ảnh đó giữ stat cũ tới khi thư mục đổi.
+    """
+    VERSION = 1
+
+    def __init__(self, root: Path, cache_dir=CACHE_DIR):
+        self.root = Path(root)
+        digest = hashlib.sha1(str(self.root).encode()).hexdigest()[:12]
+        self.file = cache_dir / f"index-{digest}.json"
+        self.dirs = {}    # relpath -> {"mtime": ns, "files": [[name, mtime_ns, size], ...], "subdirs": [name, ...]}
+        self.stats = {}   # str(path) -> (mtime_ns, size), dùng làm key cache thumbnail
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION and data.get("root") == str(self.root):
+            self.dirs = data["dirs"]
+
+    def save(self):
+        tmp = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({"version": self.VERSION, "root": str(self.root), "dirs": self.dirs}))
+            os.replace(tmp, self.file)
+        except OSError as e:
+            print(f"[wallpicker] index write failed {self.file}: {e}", file=sys.stderr)
+
+    def stat(self, path):
+        return self.stats.get(str(path))
+
+    @staticmethod
+    def scan_dir(path, mtime):
+        """Đọc một thư mục bằng os.scandir"""
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.is_dir():
+                        subdirs.append(e.name)
+                    elif os.path.splitext(e.name)[1].lower() in IMAGE_EXTS and e.is_file():
+                        st = e.stat()
+                        files.append([e.name, st.st_mtime_ns, st.st_size])
+                except OSError:
+                    continue
+        return {"mtime": mtime, "files": files, "subdirs": subdirs}
+
+    def cached_images(self):
+        """Danh sách ảnh theo index đã lưu, không chạm vào ổ đĩa (rỗng nếu chưa có index)"""
+        if "" not in self.dirs:
+            return []
+        return list(self.walk(revalidate=False))
+
+    def walk(self, revalidate=True):
+        """Yield Path ảnh theo thứ tự sorted; cập nhật và lưu index khi duyệt xong"""
+        new_dirs = {}
+        stats = {}
+        seen = set()
+        changed = False
+
+        def visit(rel):
+            nonlocal changed
+            path = self.root / rel if rel else self.root
+            entry = self.dirs.get(rel)
+            if revalidate:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    changed = True
+                    return
+                if (st.st_dev, st.st_ino) in seen:   # symlink vòng
+                    return
+                seen.add((st.st_dev, st.st_ino))
+                if entry is None or entry["mtime"] != st.st_mtime_ns:
+                    try:
+                        entry = self.scan_dir(path, st.st_mtime_ns)
+                    except OSError:
+                        changed = True
+                        return
+                    changed = True
+            elif entry is None:
+                return
+            new_dirs[rel] = entry
+
+            children = [(name, False, (mtime, size)) for name, mtime, size in entry["files"]]
+            children += [(name, True, None) for name in entry["subdirs"]]
+            for name, is_dir, st in sorted(children):
+                if is_dir:
+                    yield from visit(f"{rel}/{name}" if rel else name)
+                else:
+                    f = path / name
+                    stats[str(f)] = st
+                    yield f
+
+        yield from visit("")
+        self.stats = stats
+        if revalidate:
+            changed = changed or new_dirs.keys() != self.dirs.keys()
+            self.dirs = new_dirs
+            if changed:
+                self.save()
+
+    def path_of(self, rel):
+        return self.root / rel if rel else self.root
+
+    def add_subtree(self, rel):
+        """Quét thư mục mới xuất hiện (và con của nó); trả về (ảnh, các rel thư mục)"""
+        images, dirs = [], []
+        path = self.path_of(rel)
+        if path.is_symlink():   # symlink mới để lần walk() sau xử lý (có chặn vòng lặp)
+            return images, dirs
+        try:
+            entry = self.scan_dir(path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return images, dirs
+        self.dirs[rel] = entry
+        dirs.append(rel)
+        for name, mtime, size in entry["files"]:
+            self.stats[str(path / name)] = (mtime, size)
+            images.append(path / name)
+        for name in entry["subdirs"]:
+            sub_images, sub_dirs = self.add_subtree(f"{rel}/{name}" if rel else name)
+            images += sub_images
+            dirs += sub_dirs
+        return images, dirs
+
+    def drop_subtree(self, rel):
+        """Bỏ thư mục đã mất khỏi index; trả về ([(ảnh, stat cũ)], các rel thư mục)"""
+        removed, dirs = [], []
+        for d in [d for d in self.dirs if d == rel or d.startswith(rel + "/")]:
+            entry = self.dirs.pop(d)
+            dirs.append(d)
+            for name, mtime, size in entry["files"]:
+                f = self.path_of(d) / name
+                self.stats.pop(str(f), None)
+                removed.append((f, (mtime, size)))
+        return removed, dirs
+
+    def rescan_dir(self, rel):
+        """Quét lại đúng một thư mục (không duyệt lại cả cây).
+
+        Trả về (ảnh thêm, [(ảnh bỏ, stat cũ)], rel thư mục mới, rel thư mục mất);
+        ảnh bị sửa nằm ở cả hai danh sách."""
+        path = self.path_of(rel)
+        old = self.dirs.get(rel)
+        try:
+            entry = self.scan_dir(path, os.stat(path).st_mtime_ns)
+        except OSError:
+            removed, gone = self.drop_subtree(rel)
+            self.save()
+            return [], removed, [], gone
+        old_files = {name: (m, sz) for name, m, sz in old["files"]} if old else {}
+        new_files = {name: (m, sz) for name, m, sz in entry["files"]}
+        added = [path / n for n, st in new_files.items() if old_files.get(n) != st]
+        removed = [(path / n, st) for n, st in old_files.items() if new_files.get(n) != st]
+        for n in old_files.keys() - new_files.keys():
+            self.stats.pop(str(path / n), None)
+        for n, st in new_files.items():
+            self.stats[str(path / n)] = st
+        self.dirs[rel] = entry
+
+        new_dirs, gone_dirs = [], []
+        old_subdirs = set(old["subdirs"]) if old else set()
+        for name in set(entry["subdirs"]) - old_subdirs:
+            images, dirs = self.add_subtree(f"{rel}/{name}" if rel else name)
+            added += images
+            new_dirs += dirs
+        for name in old_subdirs - set(entry["subdirs"]):
+            images, dirs = self.drop_subtree(f"{rel}/{name}" if rel else name)
+            removed += images
+            gone_dirs += dirs
+        self.save()
+        return added, removed, new_dirs, gone_dirs
+
+class WallWatcher:
+    """Theo dõi mọi thư mục trong index bằng Gio.FileMonitor, gom sự kiện rồi rescan từng thư mục"""
+    DEBOUNCE_MS = 300
+
+    def __init__(self, index, on_change):
+        self.index = index
+        self.on_change = on_change   # on_change(added, removed)
+        self.monitors = {}           # rel -> Gio.FileMonitor
+        self.pending = {}            # rel -> timeout id
+        for rel in list(index.dirs):
+            self.watch(rel)
+
+    def watch(self, rel):
+        try:
+            mon = Gio.File.new_for_path(str(self.index.path_of(rel))).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None)
+        except GLib.Error as e:
+            print(f"[wallpicker] cannot watch {rel or self.index.root}: {e}", file=sys.stderr)
+            return
+        mon.connect("changed", self.on_event, rel)
+        self.monitors[rel] = mon
+
+    def unwatch(self, rel):
+        mon = self.monitors.pop(rel, None)
+        if mon is not None:
+            mon.cancel()
+        tid = self.pending.pop(rel, None)
+        if tid is not None:
+            GLib.source_remove(tid)
+
+    def on_event(self, monitor, file, other_file, event_type, rel):
+        if rel not in self.pending:
+            self.pending[rel] = GLib.timeout_add(self.DEBOUNCE_MS, self.flush, rel)
+
+    def flush(self, rel):
+        self.pending.pop(rel, None)
+        if rel not in self.index.dirs:
+            return False
+        added, removed, new_dirs, gone_dirs = self.index.rescan_dir(rel)
+        for d in gone_dirs:
+            self.unwatch(d)
+        for d in new_dirs:
+            self.watch(d)
+        if added or removed:
+            self.on_change(added, removed)
+        return False
+
+def merge_changes(images, added, removed):
+    """Áp thay đổi của WallWatcher lên danh sách đã sắp xếp; trả về list mới"""
+    images = list(images)
+    for path, _ in removed:
+        i = bisect.bisect_left(images, path)
+        if i < len(images) and images[i] == path:
+            del images[i]
+    for path in added:
+        i = bisect.bisect_left(images, path)
+        if i == len(images) or images[i] != path:
+            images.insert(i, path)
+    return images
+
 def list_images(folder: Path):
-    exts = {".jpg", ".jpeg", ".png", ".webp"}
-    return sorted([p for p in folder.glob("**/*") if p.suffix.lower() in exts and p.is_file()])
+    return list(WallIndex(folder).walk())
+
+class FuzzyMatch:
+    """Kết quả lọc của một query, tính lười: chỉ xét tiếp danh sách của query cha khi cần thêm kết quả.
+
+    ids giữ nguyên thứ tự thư viện; pos[j] là vị trí ngay sau ký tự khớp cuối cùng trong tên ids[j],
+    nên thêm một ký tự chỉ cần một str.find từ đó cho mỗi tên còn khớp.
+    """
+    BATCH = 256
+
+    def __init__(self, names, query, parent=None, ids=None):
+        self.names = names
+        self.query = query
+        self.parent = parent
+        self.ids = [] if ids is None else ids
+        self.pos = None if ids is not None else []   # None: query 1 ký tự, vị trí tính khi cần
+        self.cursor = 0      # đã xét tới đâu trong ids của parent
+        self.done = parent is None
+
+    def positions(self, start, end):
+        if self.pos is not None:
+            return self.pos[start:end]
+        names, c = self.names, self.query
+        return [names[i].find(c) + 1 for i in self.ids[start:end]]
+
+    def ensure(self, n):
+        """Tính thêm cho tới khi có ít nhất n kết quả hoặc đã xét hết"""
+        c = self.query[-1]
+        names, ids, pos = self.names, self.ids, self.pos
+        while len(ids) < n and not self.done:
+            parent = self.parent
+            want = self.cursor + max(self.BATCH, n - len(ids))
+            parent.ensure(want)
+            end = min(want, len(parent.ids))
+            for i, p in zip(parent.ids[self.cursor:end], parent.positions(self.cursor, end)):
+                k = names[i].find(c, p)
+                if k >= 0:
+                    ids.append(i)
+                    pos.append(k + 1)
+            self.cursor = end
+            self.done = parent.done and end == len(parent.ids)
+        return ids
+
+class FuzzyIndex:
+    """Lọc tên file kiểu fuzzy (các ký tự của query xuất hiện theo thứ tự, không phân biệt hoa thường).
+
+    postings[c] = id các tên có ký tự c, dựng một lần cho mỗi danh sách ảnh. Mỗi phím gõ thêm
+    chỉ tạo một FuzzyMatch con của query trước (stack), xoá phím thì lấy lại mức cũ; việc lọc
+    thực sự chạy lười nên trang đầu có ngay dù thư viện vài chục nghìn ảnh.
+    """
+    def __init__(self, paths):
+        self.names = [p.name.lower() for p in paths]
+        self.postings = {}
+        for i, name in enumerate(self.names):
+            for c in set(name):
+                ids = self.postings.get(c)
+                if ids is None:
+                    ids = self.postings[c] = []
+                ids.append(i)
+        self.stack = []
+
+    def query(self, text):
+        """FuzzyMatch cho text (None nếu text rỗng)"""
+        text = text.lower()
+        while self.stack and not text.startswith(self.stack[-1].query):
+            self.stack.pop()
+        m = self.stack[-1] if self.stack else None
+        for c in text[len(m.query) if m else 0:]:
+            if m is None:
+                m = FuzzyMatch(self.names, c, ids=self.postings.get(c, []))
+            elif c not in self.postings:
+                m = FuzzyMatch(self.names, m.query + c, ids=[])   # chắc chắn rỗng, khỏi quét
+            else:
+                m = FuzzyMatch(self.names, m.query + c, m)
+            self.stack.append(m)
+        return m
+
+SWWW_ARGS = ["--transition-type", "any", "--transition-fps", "60", "--transition-duration", "0.6"]
+
+# Tên socket qua các bản swww: $WAYLAND_DISPLAY-swww-daemon[.<namespace>].socket (0.9+),
+# swww-$WAYLAND_DISPLAY.socket và swww.socket (bản cũ)
+SWWW_SOCKET_GLOBS = ["*swww-daemon*.socket", "swww-*.socket", "swww.socket"]
+
+def swww_sockets():
+    """Các socket swww-daemon đang có trong runtime dir (hoặc /tmp/swww khi không có XDG_RUNTIME_DIR)"""
+    runtime = os.environ.get("XDG_RUNTIME_DIR") or f"/run/user/{os.getuid()}"
+    found = []
+    for root in (Path(runtime), Path("/tmp/swww")):
+        if root.is_dir():
+            for pattern in SWWW_SOCKET_GLOBS:
+                found += [p for p in root.glob(pattern) if p not in found]
+    return found
+
+def swww_socket_ids():
+    """{(path, inode)} của các socket swww: daemon mới tạo lại socket thì inode đổi (không fork pgrep)"""
+    ids = set()
+    for p in swww_sockets():
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        ids.add((str(p), st.st_ino))
+    return ids
+
+def swww_alive():
+    """Daemon còn sống nếu một socket swww nhận kết nối (socket sót lại sau khi daemon chết thì bị từ chối)"""
+    for path in swww_sockets():
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(0.2)
+            try:
+                sock.connect(str(path))
+            except OSError:
+                continue
+            return True
+    return False
+
+class WallpaperSetter:
+    """Đặt wallpaper bằng swww mà không chặn main loop.
+
+    Luồng nền hỏi hyprctl độ phân giải từng màn hình và tạo (hoặc lấy từ cache) bản scale sẵn
+    đúng cỡ, rồi swww img -o <màn hình> chạy qua Gio.Subprocess, kết quả về bằng callback.
+    Lỗi được báo sau qua stderr và notify-send. swww img luôn được thử trước; nếu lỗi mà không
+    socket swww nào nhận kết nối (daemon chưa chạy hoặc đã chết) thì khởi động daemon, chờ socket
+    rồi thử lại một lần; daemon vẫn sống (file hỏng, sai tên màn hình...) thì báo lỗi ngay. App được hold() tới khi xong
+    để process không thoát giữa chừng; on_done(error) dùng cho --apply.
+    """
+    SOCKET_WAIT_MS = 3000
+
+    def __init__(self, app=None, on_done=None):
+        self.app = app
+        self.on_done = on_done
+
+    def apply(self, path):
+        if self.app is not None:
+            self.app.hold()
+        job = {"path": str(path), "t0": time.monotonic(), "retried": False, "targets": [], "errors": []}
+        threading.Thread(target=self.prepare, args=(job,), daemon=True).start()
+
+    def prepare(self, job):
+        """Luồng nền: [(màn hình hoặc None, file)] cần đưa cho swww"""
+        try:
+            outputs = query_outputs()
+            if not outputs:
+                job["targets"] = [(None, job["path"])]   # không hỏi được hyprctl: swww tự scale ảnh gốc
+            for name, width, height in outputs:
+                try:
+                    with TRACE.span("rendition"):
+                        job["targets"].append((name, str(make_rendition(job["path"], width, height))))
+                except (OSError, GLib.Error, ValueError) as e:
+                    print(f"[wallpicker] rendition {name} failed: {e}", file=sys.stderr)
+                    job["targets"].append((name, job["path"]))
+        except Exception as e:
+            # Luồng chết mà không về main loop thì app.hold() không bao giờ được release (--apply treo)
+            GLib.idle_add(self.finish, job, f"{type(e).__name__}: {e}")
+            return
+        GLib.idle_add(self.start, job)
 
-def ensure_swww():
+    def start(self, job):
+        # Không dựa vào tên socket để quyết định: swww img tự báo lỗi nếu daemon chưa chạy
+        self.run_img(job)
+        return False
+
+    def restart(self, job):
+        """Bật swww-daemon rồi thử lại các target lỗi khi socket xuất hiện (hết hạn thì vẫn thử)"""
+        job["retried"] = True
+        if not self.spawn_daemon():
+            self.finish(job, "swww-daemon could not be started; " + "; ".join(job["errors"]))
+            return
+        deadline = time.monotonic() + self.SOCKET_WAIT_MS / 1000
+        before = swww_socket_ids()
+
+        def poll():
+            if swww_socket_ids() - before or time.monotonic() > deadline:
+                self.run_img(job)
+                return False
+            return True
+        GLib.timeout_add(50, poll)
+
+    def spawn_daemon(self):
+        TRACE.event("swww_daemon", "Starting swww-daemon")
+        try:
+            Gio.Subprocess.new(["swww-daemon", "--format", "xrgb"],
+                               Gio.SubprocessFlags.STDOUT_SILENCE | Gio.SubprocessFlags.STDERR_SILENCE)
+        except GLib.Error as e:
+            print(f"[wallpicker] swww-daemon: {e.message}", file=sys.stderr)
+            return False
+        return True
+
+    def run_img(self, job):
+        targets, job["targets"], job["errors"] = job["targets"], [], []   # target lỗi được thêm lại để thử lại
+        job["pending"] = len(targets)
+        for name, file in targets:
+            argv = ["swww", "img", file, *SWWW_ARGS] + (["--outputs", name] if name else [])
+            try:
+                proc = Gio.Subprocess.new(argv, Gio.SubprocessFlags.STDOUT_SILENCE | Gio.SubprocessFlags.STDERR_PIPE)
+            except GLib.Error as e:
+                self.img_done(job, name, file, e.message)
+                continue
+            proc.communicate_utf8_async(None, None, self.on_img_done, (job, name, file))
+
+    def on_img_done(self, proc, result, data):
+        job, name, file = data
+        try:
+            _, _, err = proc.communicate_utf8_finish(result)
+        except GLib.Error as e:
+            err = e.message
+        if proc.get_successful():
+            self.img_done(job, name, file)
+        else:
+            self.img_done(job, name, file, (err or "").strip() or f"swww exited with status {proc.get_exit_status()}")
+
+    def img_done(self, job, name, file, error=None):
+        if error is not None:
+            job["targets"].append((name, file))
+            job["errors"].append(f"{name}: {error}" if name else error)
+        job["pending"] -= 1
+        if job["pending"]:
+            return
+        if not job["targets"]:
+            self.finish(job)
+        elif not job["retried"] and not swww_alive():
+            # Daemon chưa chạy hoặc đã chết: bật daemon rồi thử lại phần lỗi
+            self.restart(job)
+        else:
+            self.finish(job, "; ".join(job["errors"]))
+
+    def finish(self, job, error=None):
+        path = job["path"]
+        ms = round((time.monotonic() - job["t0"]) * 1000, 1)
+        if error is None:
+            TRACE.event("apply", f"Set wallpaper: {path}", path=path, ms=ms)
+        else:
+            TRACE.event("apply_failed", f"Set wallpaper failed: {path}: {error}", path=path, ms=ms, error=error)
+            print(f"[wallpicker] swww img failed: {error}", file=sys.stderr)
+            try:
+                Gio.Subprocess.new(["notify-send", "Wallpaper picker", f"Không đặt được wallpaper: {error}"],
+                                   Gio.SubprocessFlags.STDOUT_SILENCE | Gio.SubprocessFlags.STDERR_SILENCE)
+            except GLib.Error:
+                pass
+        if self.app is not None:
+            self.app.release()
+        if self.on_done is not None:
+            self.on_done(error)
+
+class ThumbCache:
+    """Cache thumbnail trên đĩa, key theo (path, mtime, size, target), xoá bớt kiểu LRU khi vượt dung lượng"""
+    def __init__(self, root: Path, max_bytes, quality=90):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.quality = quality   # chất lượng JPEG khi ghi
+        self.usage = None  # tổng dung lượng hiện tại, tính lười ở lần ghi đầu
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(path, mtime_ns, size, target):
+        raw = f"{path}\0{mtime_ns}\0{size}\0{target}"
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def file_for(self, key):
+        return self.root / key[:2] / key
+
+    def get(self, key):
+        """Trả về pixbuf đã scale sẵn, hoặc None nếu chưa có"""
+        f = self.file_for(key)
+        try:
+            pb = GdkPixbuf.Pixbuf.new_from_file(str(f))
+        except GLib.Error:
+            return None
+        try:
+            os.utime(f)  # đánh dấu vừa dùng cho LRU
+        except OSError:
+            pass
+        return pb
+
+    def lookup(self, key):
+        """File đã cache của key (đánh dấu vừa dùng), hoặc None"""
+        f = self.file_for(key)
+        try:
+            os.utime(f)
+        except OSError:
+            return None
+        return f
+
+    def discard(self, key):
+        try:
+            os.unlink(self.file_for(key))
+        except OSError:
+            pass
+
+    def put(self, key, pb):
+        f = self.file_for(key)
+        tmp = f.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            f.parent.mkdir(parents=True, exist_ok=True)
+            # Ảnh không alpha lưu JPEG cho nhẹ, có alpha thì PNG (GdkPixbuf tự nhận dạng khi đọc)
+            if pb.get_has_alpha():
+                pb.savev(str(tmp), "png", [], [])
+            else:
+                pb.savev(str(tmp), "jpeg", ["quality"], [str(self.quality)])
+            os.replace(tmp, f)
+            written = f.stat().st_size
+        except (OSError, GLib.Error) as e:
+            print(f"[wallpicker] cache write failed {f}: {e}", file=sys.stderr)
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            return
+        with self.lock:
+            if self.usage is None:
+                self.usage = sum(size for _, size, _ in self.scan())
+            else:
+                self.usage += written
+            if self.usage > self.max_bytes:
+                self.evict()
+
+    def scan(self):
+        """Liệt kê (mtime, size, path) của mọi file trong cache"""
+        entries = []
+        try:
+            buckets = list(os.scandir(self.root))
+        except OSError:
+            return entries
+        for bucket in buckets:
+            if not bucket.is_dir():
+                continue
+            with os.scandir(bucket.path) as it:
+                for e in it:
+                    try:
+                        st = e.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def evict(self):
+        """Xoá file cũ nhất cho tới khi còn ~90% giới hạn"""
+        entries = sorted(self.scan())
+        self.usage = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * 0.9
+        for _, size, p in entries:
+            if self.usage <= limit:
+                break
+            try:
+                os.unlink(p)
+                self.usage -= size
+            except OSError:
+                pass
+
+THUMBS = ThumbCache(CACHE_DIR / "thumbs", THUMB_CACHE_MB * 1024 * 1024)
+RENDITIONS = ThumbCache(CACHE_DIR / "renditions", RENDITION_CACHE_MB * 1024 * 1024, quality=95)
+
+def query_outputs():
+    """[(tên, rộng, cao)] theo pixel thật của các màn hình đang bật, [] nếu không hỏi được hyprctl"""
     try:
-        subprocess.run(["pgrep", "-x", "swww-daemon"], check=True,
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except subprocess.CalledProcessError:
-        subprocess.Popen(["swww-daemon", "--format", "xrgb"])
+        out = subprocess.run([HYPRCTL, "monitors", "-j"], capture_output=True, text=True,
+                             timeout=2, check=True).stdout
+        monitors = json.loads(out)
+    except (OSError, subprocess.SubprocessError, ValueError) as e:
+        TRACE.event("outputs_unavailable", None, error=str(e))
+        return []
+    outputs = []
+    for m in monitors if isinstance(monitors, list) else []:
+        try:
+            name, width, height = m["name"], int(m["width"]), int(m["height"])
+            rotated = int(m.get("transform", 0)) % 2   # xoay 90/270 độ
+        except (KeyError, TypeError, ValueError):
+            continue
+        if m.get("disabled") or width <= 0 or height <= 0:
+            continue
+        if rotated:
+            width, height = height, width
+        outputs.append((name, width, height))
+    return outputs
+
+def make_rendition(path, width, height, cache=RENDITIONS):
+    """File ảnh đúng width x height (cover, crop giữa) cho một màn hình, cache theo (path, mtime, size, cỡ).
+    Chỉ tạo khi ảnh gốc lớn hơn màn hình; đã đúng cỡ hoặc nhỏ hơn (phải phóng to) thì dùng luôn ảnh gốc:
+    bản JPEG phóng to vừa nặng hơn vừa xấu hơn để swww tự scale."""
+    fmt, w, h = GdkPixbuf.Pixbuf.get_file_info(str(path))   # chỉ đọc header
+    if fmt is None:
+        raise ValueError("unsupported image")
+    if w < width or h < height or (w, h) == (width, height):
+        return Path(path)
+    key = thumb_key(path, (width, height))
+    f = cache.lookup(key)
+    if f is not None:
+        return f
+    pb = decode_at_size(path, (width, height))
+    pb = pb.new_subpixbuf((pb.get_width() - width) // 2, (pb.get_height() - height) // 2, width, height)
+    cache.put(key, pb)
+    return cache.lookup(key) or Path(path)
+
+class PixbufLRU:
+    """LRU các pixbuf đã decode trong RAM, giới hạn theo tổng số byte (chỉ dùng trên main thread)"""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        pb = self.items.get(key)
+        if pb is not None:
+            self.items.move_to_end(key)
+        return pb
 
-def load_single_image(path, canvas_size):
-    """Load ảnh và scale để cover toàn bộ canvas"""
+    def discard_path(self, path):
+        """Bỏ mọi bản của path; trả về các target đã bỏ"""
+        targets = []
+        for key in [k for k in self.items if k[0] == path]:
+            self.nbytes -= self.items.pop(key).get_byte_length()
+            targets.append(key[1])
+        return targets
+
+    def put(self, key, pb):
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.get_byte_length()
+        self.items[key] = pb
+        self.nbytes += pb.get_byte_length()
+        while self.nbytes > self.max_bytes and len(self.items) > 1:
+            _, dropped = self.items.popitem(last=False)
+            self.nbytes -= dropped.get_byte_length()
+
+def thumb_key(path, target, stat=None):
+    """Key cache của thumbnail path ở cỡ target; stat = (mtime_ns, size) nếu đã biết"""
+    if stat is None:
+        st = os.stat(path)
+        stat = (st.st_mtime_ns, st.st_size)
+    return ThumbCache.key(path, *stat, target)
+
+class ThumbAtlas:
+    """File atlas cho một cỡ thumbnail: các slot cố định chứa tile ARGB32 thô, đọc qua mmap.
+
+    Mỗi slot = header 64 byte (key) + pixel đúng định dạng cairo, nên get() chỉ bọc vùng nhớ
+    mmap thành ImageSurface, không mở file hay decode. Header được kiểm tra mỗi lần get nên
+    index JSON (thứ tự LRU) mất hay cũ cũng không trả nhầm ảnh. Đầy thì ghi đè slot ít dùng nhất.
+    """
+    VERSION = 1
+    HEADER = 64
+
+    def __init__(self, root: Path, target, max_bytes):
+        self.width, self.height = target if isinstance(target, tuple) else (target, target)
+        self.stride = cairo.ImageSurface.format_stride_for_width(cairo.FORMAT_ARGB32, self.width)
+        self.tile_bytes = self.stride * self.height
+        # Slot tròn theo trang nhớ để mỗi tile map gọn vào các page riêng
+        self.slot_bytes = -(-(self.HEADER + self.tile_bytes) // mmap.PAGESIZE) * mmap.PAGESIZE
+        self.capacity = max(4 * LAYOUT.page_size, max_bytes // self.slot_bytes)
+        name = f"atlas-{self.width}x{self.height}"
+        self.file = root / f"{name}.bin"
+        self.index_file = root / f"{name}.json"
+        self.slots = OrderedDict()   # key -> slot, cũ -> mới
+        self.free = []
+        self.used = 0                # số slot đã từng cấp (slot sau đó chưa ghi lần nào)
+        self.lock = threading.Lock()
+        self.last_save = time.monotonic()
+
+        root.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)   # một process ghi atlas tại một thời điểm
+            size = self.capacity * self.slot_bytes
+            if os.fstat(self.fd).st_size != size:
+                os.ftruncate(self.fd, size)   # file thưa: chỉ tốn đĩa cho slot đã ghi
+            self.mm = mmap.mmap(self.fd, size, access=mmap.ACCESS_WRITE)
+        except OSError:
+            os.close(self.fd)
+            raise
+        self.view = memoryview(self.mm)
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.index_file.read_text())
+        except (OSError, ValueError):
+            data = None
+        if data and data.get("version") == self.VERSION and data.get("tile") == [self.width, self.height, self.stride]:
+            entries = [(k, s) for k, s in data["slots"] if 0 <= s < self.capacity]
+        else:
+            # Không có index: dựng lại từ header của từng slot
+            entries = []
+            for slot in range(self.capacity):
+                off = slot * self.slot_bytes
+                raw = bytes(self.mm[off:off + 40])
+                if raw.strip(b"\0"):
+                    entries.append((raw.decode("ascii", "replace"), slot))
+        for key, slot in entries:
+            self.slots[key] = slot
+        self.used = max(self.slots.values(), default=-1) + 1
+        taken = set(self.slots.values())
+        self.free = [s for s in range(self.used) if s not in taken]
+
+    def save(self):
+        with self.lock:
+            data = {"version": self.VERSION, "tile": [self.width, self.height, self.stride],
+                    "slots": list(self.slots.items())}
+            self.last_save = time.monotonic()
+        tmp = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            print(f"[wallpicker] atlas index save failed: {e}", file=sys.stderr)
+
+    def surface_at(self, slot):
+        off = slot * self.slot_bytes + self.HEADER
+        return cairo.ImageSurface.create_for_data(self.view[off:off + self.tile_bytes], cairo.FORMAT_ARGB32,
+                                                  self.width, self.height, self.stride)
+
+    def __contains__(self, key):
+        return key in self.slots
+
+    def get(self, key):
+        """Tile của key bọc thẳng trên mmap, hoặc None"""
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                return None
+            off = slot * self.slot_bytes
+            if self.mm[off:off + len(key)] != key.encode():
+                del self.slots[key]
+                self.free.append(slot)
+                return None
+            self.slots.move_to_end(key)
+        return self.surface_at(slot)
+
+    def discard(self, key):
+        with self.lock:
+            slot = self.slots.pop(key, None)
+            if slot is not None:
+                off = slot * self.slot_bytes
+                self.mm[off:off + self.HEADER] = bytes(self.HEADER)
+                self.free.append(slot)
+
+    def put(self, key, pb):
+        """Vẽ pixbuf (đã cover target) vào slot, crop ở giữa; trả về tile trên mmap"""
+        with self.lock:
+            slot = self.slots.pop(key, None)
+            if slot is None:
+                if self.free:
+                    slot = self.free.pop()
+                elif self.used < self.capacity:
+                    slot = self.used
+                    self.used += 1
+                else:
+                    _, slot = self.slots.popitem(last=False)
+            off = slot * self.slot_bytes
+            self.mm[off:off + self.HEADER] = bytes(self.HEADER)   # slot vô hiệu trong lúc ghi pixel
+            surface = self.surface_at(slot)
+            cr = cairo.Context(surface)
+            cr.set_operator(cairo.Operator.SOURCE)
+            cr.set_source_rgba(0, 0, 0, 0)
+            cr.paint()
+            cr.translate((self.width - pb.get_width()) / 2, (self.height - pb.get_height()) / 2)
+            Gdk.cairo_set_source_pixbuf(cr, pb, 0, 0)
+            cr.paint()
+            del cr
+            surface.flush()
+            raw = key.encode()
+            self.mm[off:off + len(raw)] = raw
+            self.slots[key] = slot
+            stale = time.monotonic() - self.last_save > 5
+        if stale:
+            self.save()
+        return surface
+
+ATLASES = {}   # target -> ThumbAtlas, None nếu không dùng được
+ATLAS_LOCK = threading.Lock()
+
+def atlas_for(target):
+    """Atlas cho cỡ target (tạo lười), None nếu tắt hoặc process khác đang giữ"""
+    if ATLAS_MB <= 0:
+        return None
+    with ATLAS_LOCK:
+        if target not in ATLASES:
+            try:
+                ATLASES[target] = ThumbAtlas(CACHE_DIR, target, ATLAS_MB * 1024 * 1024)
+            except OSError as e:
+                print(f"[wallpicker] atlas disabled for {target}: {e}", file=sys.stderr)
+                ATLASES[target] = None
+        return ATLASES[target]
+
+def pack_tile(path, target, stat, pb):
+    """Ghi thumbnail vừa decode vào atlas; trả về tile trên mmap (hoặc pb nếu không có atlas)"""
+    atlas = atlas_for(target)
+    if atlas is None:
+        return pb
     try:
+        with TRACE.span("atlas_pack"):
+            return atlas.put(thumb_key(path, target, stat), pb)
+    except (OSError, ValueError) as e:
+        print(f"[wallpicker] atlas pack failed {path}: {e}", file=sys.stderr)
+        return pb
+
+def save_atlases():
+    for atlas in list(ATLASES.values()):
+        if atlas is not None:
+            atlas.save()
+
+def set_source_image(cr, img, x, y):
+    """Đặt source là pixbuf hoặc tile atlas (cairo.ImageSurface)"""
+    if isinstance(img, cairo.ImageSurface):
+        cr.set_source_surface(img, x, y)
+    else:
+        Gdk.cairo_set_source_pixbuf(cr, img, x, y)
+
+def cover_size(w, h, target):
+    """Kích thước nhỏ nhất (giữ tỉ lệ) để ảnh w x h phủ kín target; target là int hoặc (w, h)"""
+    tw, th = target if isinstance(target, tuple) else (target, target)
+    s = max(tw / w, th / h)
+    return max(1, math.ceil(w * s)), max(1, math.ceil(h * s))
+
+def sector_bbox(a1, a2, cx, cy, radius, inner):
+    """Bounding box (min_x, min_y, max_x, max_y) của miếng vòng từ góc a1 tới a2"""
+    angles = [a1, a2] + [a1 + j * (a2 - a1) / 4 for j in range(1, 4)]
+    xs, ys = [], []
+    for a in angles:
+        for r in (inner, radius):
+            xs.append(cx + r * math.cos(a))
+            ys.append(cy + r * math.sin(a))
+    return min(xs), min(ys), max(xs), max(ys)
+
+class RingLayout:
+    """Bố cục một trang: các vòng đồng tâm chia đều phần giữa lỗ và mép.
+
+    Vòng trong cùng có `sectors` miếng, vòng ngoài dài hơn nên nhiều miếng hơn (tỉ lệ theo
+    bán kính giữa vòng) để miếng nào cũng gần vuông. Bán kính tính theo tỉ lệ với bán kính vòng ngoài.
+    """
+    def __init__(self, sectors=PAGE_SIZE, rings=RINGS):
+        self.sectors = max(1, sectors)
+        self.rings = max(1, rings)
+        self.cache = {}
+
+    def configure(self, sectors=None, rings=None):
+        """Đổi bố cục (từ CLI) trước khi tạo picker"""
+        if sectors:
+            self.sectors = max(1, sectors)
+        if rings:
+            self.rings = max(1, rings)
+        self.cache.clear()
+
+    @property
+    def page_size(self):
+        return sum(cap for _, _, cap in self.bands(self.rings))
+
+    def bands(self, rings):
+        """(f0, f1, sức chứa) của từng vòng khi chia thành `rings` vòng"""
+        step = (1 - INNER_HOLE_RATIO) / rings
+        bands = [(INNER_HOLE_RATIO + k * step, INNER_HOLE_RATIO + (k + 1) * step) for k in range(rings)]
+        mid0 = sum(bands[0]) / 2
+        return [(f0, f1, max(1, round(self.sectors * (f0 + f1) / 2 / mid0))) for f0, f1 in bands]
+
+    def split(self, n):
+        """Các vòng của trang n ảnh: ((f0, f1, số miếng), ...).
+        Dùng ít vòng nhất đủ chứa; trang thiếu thì chia theo tỉ lệ sức chứa, phần dư ưu tiên vòng ngoài."""
+        if n in self.cache:
+            return self.cache[n]
+        for rings in range(1, self.rings + 1):
+            bands = self.bands(rings)
+            total = sum(cap for _, _, cap in bands)
+            if total >= n:
+                break
+        counts = [max(1, cap * n // total) for _, _, cap in bands] if n >= len(bands) else [n]
+        k = len(counts) - 1
+        while sum(counts) < n:
+            if counts[k] < bands[k][2]:
+                counts[k] += 1
+            k = (k - 1) % len(counts)
+        while sum(counts) > n:
+            counts[counts.index(max(counts))] -= 1
+        split = tuple((f0, f1, c) for (f0, f1, _), c in zip(bands, counts))
+        self.cache[n] = split
+        return split
+
+LAYOUT = RingLayout()
+
+def sector_thumb_size(n, size=SIZE, band=(INNER_HOLE_RATIO, 1.0)):
+    """Kích thước thumbnail đủ phủ mọi miếng khi vòng `band` chia n miếng (kể cả hệ số 1.1 của on_draw)"""
+    radius = size / 2
+    n = max(1, n)
+    bw = bh = 0
+    for i in range(n):
+        x0, y0, x1, y1 = sector_bbox(2*math.pi*i/n, 2*math.pi*(i+1)/n, radius, radius, radius * band[1], radius * band[0])
+        bw, bh = max(bw, x1 - x0), max(bh, y1 - y0)
+    return math.ceil(bw * 1.1), math.ceil(bh * 1.1)
+
+def page_thumb_targets(n, size=SIZE, layout=LAYOUT):
+    """Kích thước thumbnail picker cần cho từng miếng của trang có n ảnh (mỗi vòng một cỡ)"""
+    if THUMB_MODE != "sector":
+        return [size] * n
+    targets = []
+    for f0, f1, count in layout.split(n):
+        targets += [sector_thumb_size(count, size, (f0, f1))] * count
+    return targets
+
+def decode_at_size(path, target):
+    """Decode thẳng ra kích thước cover target thay vì decode full rồi scale_simple"""
+    fmt, w, h = GdkPixbuf.Pixbuf.get_file_info(str(path))   # chỉ đọc header
+    if fmt is None or not w or not h:
+        raise ValueError("unsupported image")
+    neww, newh = cover_size(w, h, target)
+    if neww < w:
+        # Loader tự thu nhỏ khi decode (JPEG dùng DCT scaling) nên không có buffer full-size
+        with TRACE.span("decode_at_scale"):
+            return GdkPixbuf.Pixbuf.new_from_file_at_scale(str(path), neww, newh, False)
+    with TRACE.span("decode"):
         pb = GdkPixbuf.Pixbuf.new_from_file(str(path))
+    with TRACE.span("scale"):
+        return pb.scale_simple(neww, newh, GdkPixbuf.InterpType.BILINEAR)
+
+def load_single_image(path, canvas_size, cache=THUMBS, stat=None):
+    """Load ảnh và scale để cover toàn bộ canvas (ưu tiên lấy từ cache); canvas_size là int hoặc (w, h).
+    stat = (mtime_ns, size) lấy từ WallIndex để khỏi stat file gốc."""
+    try:
+        key = None
+        if cache is not None:
+            key = thumb_key(path, canvas_size, stat)
+            with TRACE.span("thumb_read"):
+                pb = cache.get(key)
+            if pb is not None:
+                return pb
         # Scale để cover toàn bộ canvas (có thể crop)
-        sx = canvas_size / pb.get_width()
-        sy = canvas_size / pb.get_height()
-        s = max(sx, sy)  # cover - đảm bảo ảnh đủ lớn để phủ toàn bộ
-        neww = max(1, int(pb.get_width() * s))
-        newh = max(1, int(pb.get_height() * s))
-        pb = pb.scale_simple(neww, newh, GdkPixbuf.InterpType.BILINEAR)
+        pb = decode_at_size(path, canvas_size)
+        if key is not None:
+            cache.put(key, pb)
         return pb
     except Exception as e:
         print(f"[wallpicker] skip {path}: {e}", file=sys.stderr)
         return None
 
-# ---- Main Window ----
-class RadialPicker(Gtk.ApplicationWindow):
-    def __init__(self, app, images):
-        super().__init__(application=app, title="wallpicker")
-        self.set_default_size(SIZE, SIZE)
-        self.set_decorated(False)
-        self.set_resizable(False)
-        self.set_modal(True)
-
-        self.images = images
-        self.all_images = images  # Lưu tất cả ảnh
-        self.page_size = 6  # Số ảnh tối đa mỗi trang
-        self.current_page = 0
-        self.total_pages = max(1, math.ceil(len(images) / self.page_size))
-
-        # Lấy ảnh cho trang hiện tại
-        self.current_images = self.get_current_page_images()
-        self.n = len(self.current_images)
-        self.hovered_sector = -1  # Track which sector is hovered
-
-        # Hover preview variables
-        self.hover_timer_id = None
-        self.hover_start_time = 0
-        self.preview_active = False  # True khi đang preview trên canvas
-        self.preview_pixbuf = None   # Pixbuf của ảnh preview
-        self.preview_image_path = None  # Path của ảnh đang preview
-        self.close_button_rect = None  # Vị trí và kích thước nút đóng preview
-
-        print(f"[wallpicker] Page {self.current_page + 1}/{self.total_pages} ({len(self.current_images)} images)")
-
-        # Canvas size cho việc scale ảnh để cover toàn bộ
-        self.canvas_size = SIZE
-
-        self.pixbufs = [None] * self.page_size  # Khởi tạo list với page_size
-        self.load_cache = {}  # Cache để tránh load lại ảnh
-        self.loaded_count = 0
-
-        # Setup UI trước
-        self.setup_ui()
-
-                # Bắt đầu load ảnh trong background
-        self.load_images_async(self.current_images, SIZE)
-
-    def get_current_page_images(self):
-        """Lấy danh sách ảnh cho trang hiện tại"""
-        start_idx = self.current_page * self.page_size
-        end_idx = start_idx + self.page_size
-        return self.all_images[start_idx:end_idx]
-
-    def next_page(self):
-        """Chuyển sang trang tiếp theo"""
-        if self.current_page < self.total_pages - 1:
-            self.cancel_hover_timer()
-            self.preview_active = False
-            self.preview_pixbuf = None
-            self.preview_image_path = None
-            self.close_button_rect = None
-            self.current_page += 1
-            self.current_images = self.get_current_page_images()
-            self.n = len(self.current_images)
-            self.hovered_sector = -1
-            self.pixbufs = [None] * self.page_size  # Reset pixbufs cho trang mới
-            self.loaded_count = 0
-            self.load_images_async(self.current_images, SIZE)
-            print(f"[wallpicker] Page {self.current_page + 1}/{self.total_pages}")
-            self.area.queue_draw()
-
-    def prev_page(self):
-        """Chuyển sang trang trước"""
-        if self.current_page > 0:
-            self.cancel_hover_timer()
-            self.preview_active = False
-            self.preview_pixbuf = None
-            self.preview_image_path = None
-            self.close_button_rect = None
-            self.current_page -= 1
-            self.current_images = self.get_current_page_images()
-            self.n = len(self.current_images)
-            self.hovered_sector = -1
-            self.pixbufs = [None] * self.page_size  # Reset pixbufs cho trang mới
-            self.loaded_count = 0
-            self.load_images_async(self.current_images, SIZE)
-            print(f"[wallpicker] Page {self.current_page + 1}/{self.total_pages}")
-            self.area.queue_draw()
-
-    def load_images_async(self, images, target_size):
-        """Load ảnh trong background thread"""
-        print(f"[wallpicker] Loading {len(images)} images in background...", flush=True)
-
-        def load_worker():
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                # Submit tất cả tasks
-                future_to_index = {
-                    executor.submit(load_single_image, path, target_size): i
-                    for i, path in enumerate(images)
-                }
-
-                # Process results as they complete
-                for future in as_completed(future_to_index):
-                    index = future_to_index[future]
-                    result = future.result()
-
-                    # Update UI trong main thread
-                    GLib.idle_add(self.on_image_loaded, index, result)
-
-        # Start loading thread
-        threading.Thread(target=load_worker, daemon=True).start()
-
-    def on_image_loaded(self, index, pixbuf):
-        """Callback khi một ảnh được load xong"""
-        if index < len(self.pixbufs):  # Đảm bảo index không vượt quá
-            self.pixbufs[index] = pixbuf
-            self.loaded_count += 1
-
-            # Progress update
-            if self.loaded_count % 3 == 0 or self.loaded_count == len(self.current_images):
-                print(f"[wallpicker] Loaded {self.loaded_count}/{len(self.current_images)} images")
-
-            # Redraw để hiển thị ảnh mới (chỉ khi area đã được tạo)
-            # Batch updates để tránh redraw quá nhiều
-            if hasattr(self, 'area') and (self.loaded_count % 2 == 0 or self.loaded_count == len(self.current_images)):
-                self.area.queue_draw()
-        return False  # Remove from idle queue
-
-    def start_hover_timer(self, sector_idx):
-        """Bắt đầu timer cho hover preview"""
-        if self.hover_timer_id:
-            GLib.source_remove(self.hover_timer_id)
-
-        def on_hover_timeout():
-            if (self.hovered_sector == sector_idx and
-                sector_idx < len(self.current_images) and
-                not self.preview_active):
-
-                # Load ảnh preview trên canvas thay vì thay đổi wallpaper
-                preview_path = self.current_images[sector_idx]
-                self.preview_pixbuf = load_single_image(preview_path, SIZE)
-
-                if self.preview_pixbuf:
-                    self.preview_active = True
-                    self.preview_image_path = str(preview_path)
-                    print(f"[wallpicker] Canvas preview: {preview_path}")
-
-                    # Đảm bảo area có focus để nhận keyboard input
-                    self.area.grab_focus()
-
-                    # Redraw để hiển thị preview trên canvas
-                    self.area.queue_draw()
-
-            self.hover_timer_id = None
-            return False  # Remove timer
-
-        # Set timer cho 1.5 giây
-        self.hover_timer_id = GLib.timeout_add(1500, on_hover_timeout)
-
-    def cancel_hover_timer(self):
-        """Hủy hover timer"""
-        if self.hover_timer_id:
-            GLib.source_remove(self.hover_timer_id)
-            self.hover_timer_id = None
-
-    def setup_ui(self):
-        """Setup UI elements"""
-        # Vẽ
-        self.area = Gtk.DrawingArea()
-        self.area.set_content_width(SIZE)
-        self.area.set_content_height(SIZE)
-        self.area.set_draw_func(self.on_draw)
-        self.set_child(self.area)
-
-        # Click
-        click = Gtk.GestureClick()
-        click.connect("released", self.on_released)
-        self.area.add_controller(click)
-
-        # Mouse motion để detect hover
-        motion = Gtk.EventControllerMotion()
-        motion.connect("motion", self.on_motion)
-        motion.connect("leave", self.on_leave)
-        self.area.add_controller(motion)
-
-        # Keyboard để navigation
-        key = Gtk.EventControllerKey()
-        key.connect("key-pressed", self.on_key_pressed)
-        self.area.add_controller(key)
-
-        # Focus để nhận keyboard input
-        self.area.set_can_focus(True)
-        self.area.grab_focus()
-
-    def on_draw(self, area, cr: cairo.Context, width, height):
-        # --- Clear toàn bộ surface để tránh clip/blur cũ còn sót ---
-        cr.save()
-        cr.set_operator(cairo.Operator.CLEAR)
-        cr.paint()
-        cr.restore()
-        cr.set_operator(cairo.Operator.OVER)
-
-        # (tuỳ – khử răng cưa)
-        if hasattr(cairo, "Antialias"):
-            cr.set_antialias(cairo.Antialias.BEST)
-
+# ---- Decode backends ----
+def decode_to_shm(path, target, stat):
+    """Chạy trong process con: decode (qua cache đĩa) rồi ghi pixel RGB(A) vào shared memory"""
+    pb = load_single_image(path, target, stat=stat)
+    if pb is None:
+        return None
+    data = pb.read_pixel_bytes().get_data()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    shm.close()   # main process unlink sau khi đọc
+    return shm.name, len(data), pb.get_width(), pb.get_height(), pb.get_rowstride(), pb.get_has_alpha()
+
+def pixbuf_from_shm(meta):
+    """Bọc pixel từ shared memory thành Pixbuf (một lần copy vào GLib.Bytes)"""
+    name, size, w, h, rowstride, has_alpha = meta
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        data = GLib.Bytes.new(shm.buf[:size].tobytes())
+    finally:
+        shm.close()
+        shm.unlink()
+    return GdkPixbuf.Pixbuf.new_from_bytes(data, GdkPixbuf.Colorspace.RGB, has_alpha, 8, w, h, rowstride)
+
+class ThreadDecoder:
+    """Decode ngay trong luồng của ImageLoader (GdkPixbuf nhả GIL khi decode)"""
+    def __init__(self, workers=4):
+        self.workers = workers
+
+    def decode(self, path, target, stat=None):
+        return load_single_image(path, target, stat=stat)
+
+class ProcessDecoder:
+    """Decode trong process pool cỡ os.cpu_count() để không bị GIL giới hạn; pixel về qua shared memory"""
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 4
+        # forkserver: process con không thừa hưởng trạng thái GTK/luồng của process chính
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=get_context("forkserver"))
+
+    def decode(self, path, target, stat=None):
+        meta = self.pool.submit(decode_to_shm, path, target, stat).result()
+        return pixbuf_from_shm(meta) if meta else None
+
+def make_decoder(backend=DECODE_BACKEND):
+    if backend == "process":
+        return ProcessDecoder()
+    return ThreadDecoder()
+
+class ImageLoader:
+    """Pool luồng dùng chung cho mọi trang: hàng đợi ưu tiên, job gắn generation để huỷ khi đổi trang"""
+    PRIO_VISIBLE = 0    # miếng đang hiển thị
+    PRIO_PREFETCH = 1   # trang kề
+
+    def __init__(self, workers=None, stat_of=None, decoder=None):
+        self.decoder = decoder or make_decoder()
+        workers = workers or self.decoder.workers   # process backend: mỗi luồng chờ một process
+        self.stat_of = stat_of   # path -> (mtime_ns, size) hoặc None
+        self.queue = []   # heap (priority, seq, gen, path, target, callback, tag)
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.seq = itertools.count()
+        for _ in range(workers):
+            threading.Thread(target=self.worker, daemon=True).start()
+
+    def new_generation(self):
+        """Bắt đầu generation mới và bỏ mọi job còn xếp hàng"""
+        with self.cond:
+            self.generation += 1
+            self.queue.clear()
+            return self.generation
+
+    def submit(self, gen, priority, path, target, callback, tag=None):
+        """callback(gen, tag, path, target, pixbuf) chạy trên main loop nếu gen vẫn còn hiệu lực.
+        pixbuf có thể là tile atlas (cairo.ImageSurface) thay vì GdkPixbuf."""
+        with self.cond:
+            if gen != self.generation:
+                return
+            heapq.heappush(self.queue, (priority, next(self.seq), gen, path, target, callback, tag))
+            self.cond.notify()
+
+    def worker(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                _, _, gen, path, target, callback, tag = heapq.heappop(self.queue)
+            if gen != self.generation:
+                continue
+            stat = self.stat_of(path) if self.stat_of else None
+            try:
+                result = self.decoder.decode(path, target, stat)
+            except Exception as e:   # process con chết, shm lỗi...
+                print(f"[wallpicker] skip {path}: {e}", file=sys.stderr)
+                result = None
+            if result is not None and gen == self.generation:
+                result = pack_tile(path, target, stat, result)
+            # Kết quả cũ bị bỏ ngay tại đây, không đẩy vào GTK main loop
+            if gen == self.generation:
+                GLib.idle_add(callback, gen, tag, path, target, result)
+
+# ---- Features: pHash + màu chủ đạo ----
+def dct_matrix(n):
+    """Ma trận DCT-II trực chuẩn n x n"""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    d = np.sqrt(2 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    d[0] /= np.sqrt(2)
+    return d
+
+def phash_batch(rgb):
+    """pHash 64-bit cho lô ảnh (N, 32, 32, 3) uint8: DCT ảnh xám, lấy 8x8 tần số thấp so với median"""
+    gray = rgb.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    d = dct_matrix(rgb.shape[1]).astype(np.float32)
+    low = np.einsum("ij,njk,lk->nil", d[:8], gray, d[:8]).reshape(len(rgb), 64)
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)   # bỏ hệ số DC khi lấy median
+    return np.bitwise_or.reduce(bits.astype(np.uint64) << np.arange(64, dtype=np.uint64), axis=1)
+
+def dominant_colour_batch(rgb):
+    """Màu chủ đạo (N, 3): trung bình các pixel thuộc ô đông nhất khi lượng tử RGB 4x4x4"""
+    n = len(rgb)
+    px = rgb.reshape(n, -1, 3)
+    q = px >> 6
+    bins = q[..., 0].astype(np.int64) * 16 + q[..., 1] * 4 + q[..., 2]
+    counts = np.bincount((bins + np.arange(n)[:, None] * 64).ravel(), minlength=n * 64).reshape(n, 64)
+    mask = bins == counts.argmax(axis=1)[:, None]
+    sums = (px * mask[..., None]).sum(axis=1)
+    return np.rint(sums / mask.sum(axis=1)[:, None]).astype(np.uint8)
+
+def popcount64(x):
+    if hasattr(np, "bitwise_count"):   # NumPy >= 2.0
+        return np.bitwise_count(x)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+def find_duplicates(known, hashes, ranks, max_distance=6):
+    """Tập ảnh bị ẩn ở chế độ bỏ trùng: mỗi nhóm pHash cách nhau <= max_distance bit giữ ảnh rank lớn nhất.
+
+    Hai hash như vậy trùng nhau hoàn toàn ở ít nhất một trong max_distance + 1 khối bit (chia đều
+    64 bit, 9-10 bit mỗi khối), nên chỉ cần so các cặp cùng khoá khối. Sắp theo khoá rồi so phần tử
+    i với i + d (d = 1, 2, ...) trên cả mảng một lượt: bộ nhớ O(n), không dựng ma trận m x m.
+    Chỉ dùng dữ liệu truyền vào nên chạy được trong luồng nền."""
+    n = len(known)
+    if n < 2:
+        return set()
+    hashes = np.array(hashes, dtype=np.uint64)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    blocks = max_distance + 1
+    widths = [64 // blocks + (b < 64 % blocks) for b in range(blocks)]
+    shift = 0
+    for width in widths:
+        keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+        order = np.argsort(keys, kind="stable")
+        k, h = keys[order], hashes[order]
+        idx = np.nonzero(k[1:] == k[:-1])[0]
+        d = 1
+        while len(idx):
+            close = idx[popcount64(h[idx] ^ h[idx + d]) <= max_distance]
+            for a, c in zip(order[close].tolist(), order[close + d].tolist()):
+                parent[find(a)] = find(c)
+            d += 1
+            idx = idx[idx + d < n]
+            idx = idx[k[idx + d] == k[idx]]   # cùng khoá ở khoảng cách d thì cũng cùng ở d - 1
+
+    groups = {}
+    for i in range(n):
+        groups.setdefault(find(i), []).append(i)
+    hidden = set()
+    for members in groups.values():
+        if len(members) > 1:
+            keep = max(members, key=ranks.__getitem__)
+            hidden.update(known[i] for i in members if i != keep)
+    return hidden
+
+class FeatureIndex:
+    """pHash và màu chủ đạo của từng ảnh, tính từ thumbnail đã cache và lưu cạnh WallIndex.
+
+    Cần NumPy (tuỳ chọn). Ảnh chưa có thumbnail thì decode ảnh gốc thẳng về 32x32 một lần,
+    sau đó chỉ tính lại khi (mtime, size) đổi.
+    """
+    VERSION = 1
+    HASH_SIZE = 32        # cạnh ảnh xám đưa vào DCT
+    DUP_DISTANCE = 6      # Hamming tối đa giữa hai pHash coi là cùng ảnh
+    COLOUR_DISTANCE = 60  # khoảng cách RGB tối đa của chế độ lọc theo màu
+
+    def __init__(self, root: Path, cache_dir=CACHE_DIR):
+        self.root = Path(root)
+        digest = hashlib.sha1(str(self.root).encode()).hexdigest()[:12]
+        self.file = cache_dir / f"features-{digest}.json"
+        self.entries = {}   # str(path) -> [mtime_ns, size, phash, [r, g, b], số pixel ảnh gốc]
+        self.version = 0    # tăng mỗi lần merge, làm key cho cache ảnh trùng
+        self.dup_key = None
+        self.dup_hidden = None
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.file.read_text())
+        except (OSError, ValueError):
+            return
+        if data.get("version") == self.VERSION and data.get("root") == str(self.root):
+            self.entries = {p: [m, s, int(h, 16), c, px] for p, (m, s, h, c, px) in data["entries"].items()}
+
+    def save(self):
+        entries = {p: [m, s, f"{h:016x}", c, px] for p, (m, s, h, c, px) in self.entries.items()}
+        tmp = self.file.with_name(f"{self.file.name}.{os.getpid()}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps({"version": self.VERSION, "root": str(self.root), "entries": entries}))
+            os.replace(tmp, self.file)
+        except OSError as e:
+            print(f"[wallpicker] feature index save failed: {e}", file=sys.stderr)
+
+    def get(self, path):
+        return self.entries.get(str(path))
+
+    def missing(self, images, stat_of):
+        """(path, stat, vị trí) các ảnh chưa có hoặc đã đổi từ lần tính trước"""
+        todo = []
+        for pos, path in enumerate(images):
+            stat = stat_of(path) if stat_of else None
+            if stat is None:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stat = (st.st_mtime_ns, st.st_size)
+            e = self.entries.get(str(path))
+            if e is None or (e[0], e[1]) != tuple(stat):
+                todo.append((path, stat, pos))
+        return todo
+
+    def source_pixels(self, path, stat, target):
+        """Pixel RGB 32x32 lấy từ thumbnail đã cache (hoặc ảnh gốc nếu chưa có) và số pixel ảnh gốc"""
+        n = self.HASH_SIZE
+        src = THUMBS.file_for(thumb_key(path, target, stat))
+        if not src.exists():
+            src = path
+        pb = GdkPixbuf.Pixbuf.new_from_file_at_scale(str(src), n, n, False)
+        _, w, h = GdkPixbuf.Pixbuf.get_file_info(str(path))   # chỉ đọc header
+        raw = np.frombuffer(pb.read_pixel_bytes().get_data(), dtype=np.uint8)
+        rowstride, channels = pb.get_rowstride(), pb.get_n_channels()
+        rows = np.lib.stride_tricks.as_strided(raw, (n, n, channels), (rowstride, channels, 1))
+        return rows[..., :3], w * h
+
+    def compute(self, images, stat_of=None, batch=256, only=None):
+        """Tính feature còn thiếu (chạy được trong luồng nền); trả về dict để merge() trên main thread.
+        only: chỉ tính cho các path này (vẫn dùng vị trí trong images để tìm thumbnail)."""
+        todo = [t for t in self.missing(images, stat_of) if only is None or t[0] in only]
+        # Thumbnail picker nằm ở cỡ của vị trí ảnh trong trang, tính lại để tìm đúng file cache
+        page_size = LAYOUT.page_size
+        targets = {}
+        result = {}
+        TRACE.event("features", f"Computing features for {len(todo)} images", count=len(todo))
+        for start in range(0, len(todo), batch):
+            chunk, pixels, meta = todo[start:start + batch], [], []
+            for path, stat, pos in chunk:
+                page = pos // page_size
+                if page not in targets:
+                    targets[page] = page_thumb_targets(len(images[page * page_size:(page + 1) * page_size]))
+                try:
+                    rgb, area = self.source_pixels(path, stat, targets[page][pos % page_size])
+                except (GLib.Error, TypeError, ValueError) as e:
+                    print(f"[wallpicker] features skip {path}: {e}", file=sys.stderr)
+                    continue
+                pixels.append(rgb)
+                meta.append((path, stat, area))
+            if not pixels:
+                continue
+            with TRACE.span("features_batch"):
+                rgb = np.stack(pixels)
+                hashes = phash_batch(rgb)
+                colours = dominant_colour_batch(rgb)
+            for (path, stat, area), h, c in zip(meta, hashes.tolist(), colours.tolist()):
+                result[str(path)] = [stat[0], stat[1], h, c, area]
+        return result
+
+    def merge(self, entries):
+        self.entries.update(entries)
+        if entries:
+            self.version += 1
+        self.save()
+
+    def duplicates_job(self, images):
+        """Snapshot (trên main thread) để find_duplicates chạy ở luồng nền: (key, ảnh, hash, thứ hạng).
+        key đổi khi danh sách ảnh có feature hoặc chính các feature đổi (merge)."""
+        known = [p for p in images if str(p) in self.entries]
+        e = self.entries
+        key = (self.version, frozenset(known))
+        hashes = [e[str(p)][2] for p in known]
+        ranks = [(e[str(p)][4], e[str(p)][1], -i) for i, p in enumerate(known)]   # giữ ảnh nhiều pixel nhất
+        return key, known, hashes, ranks
+
+    def cached_duplicates(self, key):
+        return self.dup_hidden if key == self.dup_key else None
+
+    def store_duplicates(self, key, hidden):
+        if key[0] == self.version:
+            self.dup_key, self.dup_hidden = key, hidden
+
+    def sort_by_colour(self, images):
+        """Sắp theo hue của màu chủ đạo, ảnh gần xám xếp cuối theo độ sáng; ảnh chưa có feature giữ cuối cùng"""
+        known = [p for p in images if str(p) in self.entries]
+        rgb = np.array([self.entries[str(p)][3] for p in known], dtype=np.float32).reshape(-1, 3) / 255
+        mx, mn = rgb.max(axis=1), rgb.min(axis=1)
+        delta = mx - mn
+        sat = np.where(mx > 0, delta / np.maximum(mx, 1e-6), 0)
+        r, g, b = rgb.T
+        safe = np.maximum(delta, 1e-6)
+        hue = np.select([mx == r, mx == g], [((g - b) / safe) % 6, (b - r) / safe + 2], (r - g) / safe + 4) / 6
+        grey = sat < 0.15
+        order = np.lexsort((-mx, np.where(grey, 0, hue), grey))
+        known_set = set(known)
+        return [known[i] for i in order] + [p for p in images if p not in known_set]
+
+    def near_colour(self, images, colour):
+        """Ảnh có màu chủ đạo gần colour, gần nhất trước"""
+        known = [p for p in images if str(p) in self.entries]
+        if not known:
+            return []
+        rgb = np.array([self.entries[str(p)][3] for p in known], dtype=np.float32)
+        dist = np.linalg.norm(rgb - np.array(colour, dtype=np.float32), axis=1)
+        order = np.argsort(dist, kind="stable")
+        return [known[i] for i in order if dist[i] <= self.COLOUR_DISTANCE]
+
+# ---- Render ----
+class RingRenderer:
+    """Cache hình học sector theo (size, bố cục) và surface vòng đã ghép sẵn ảnh của từng miếng"""
+    def __init__(self, layout=LAYOUT):
+        self.layout = layout
+        self.geom_key = None
+        self.sectors = []     # mỗi miếng: dict(a1, a2, r0, r1, path, bbox)
+        self.bands = []       # mỗi vòng: (r0, r1, số miếng, index miếng đầu)
+        self.surface = None
+        self.surface_key = None
+        self.drawn = []       # pixbuf đã ghép lên surface cho từng miếng
+
+    def geometry(self, width, height, n):
+        """Tính (một lần cho mỗi (width, height, bố cục của n ảnh)) path và bounding box của các miếng.
+        Miếng đánh số từ vòng trong ra ngoài, trong mỗi vòng theo chiều kim đồng hồ."""
+        split = self.layout.split(n)
+        key = (width, height, split)
+        if key == self.geom_key:
+            return self.sectors
         cx, cy = width/2, height/2
         radius = min(width, height)/2
         inner = radius * INNER_HOLE_RATIO
+        scratch = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+        self.sectors = []
+        self.bands = []
+        for f0, f1, count in split:
+            r0, r1 = radius * f0, radius * f1
+            self.bands.append((r0, r1, count, len(self.sectors)))
+            for i in range(count):
+                a1 = 2*math.pi*i/count
+                a2 = 2*math.pi*(i+1)/count
+                # Path "ring sector"
+                scratch.new_path()
+                scratch.move_to(cx + r0*math.cos(a1), cy + r0*math.sin(a1))
+                scratch.arc(cx, cy, r1, a1, a2)
+                scratch.line_to(cx + r0*math.cos(a2), cy + r0*math.sin(a2))
+                scratch.arc_negative(cx, cy, r0, a2, a1)
+                scratch.close_path()
+                self.sectors.append({
+                    "a1": a1, "a2": a2, "r0": r0, "r1": r1,
+                    "path": scratch.copy_path(),
+                    "bbox": sector_bbox(a1, a2, cx, cy, r1, r0),
+                })
+        self.cx, self.cy, self.radius, self.inner = cx, cy, radius, inner
+        self.geom_key = key
+        return self.sectors
+
+    def sector_at(self, x, y):
+        """Index miếng chứa điểm (x, y) theo hình học đã tính, -1 nếu nằm ngoài vòng"""
+        dx, dy = x - self.cx, y - self.cy
+        r = math.hypot(dx, dy)
+        angle = math.atan2(dy, dx) % (2*math.pi)
+        for r0, r1, count, first in self.bands:
+            if count and r0 <= r <= r1:
+                return first + min(count - 1, int(angle / (2*math.pi) * count))
+        return -1
+
+    def invalidate(self):
+        """Bỏ surface vòng (đổi trang) để lần vẽ sau ghép lại từ đầu"""
+        self.surface = None
+
+    def ring(self, width, height, n, pixbufs, scale=1):
+        """Trả về surface vòng; chỉ ghép lại những miếng có pixbuf thay đổi"""
+        sectors = self.geometry(width, height, n)
+        key = (width, height, n, scale)
+        if self.surface is None or self.surface_key != key:
+            self.surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, math.ceil(width*scale), math.ceil(height*scale))
+            self.surface.set_device_scale(scale, scale)
+            self.surface_key = key
+            self.drawn = [False] * n   # False = chưa vẽ (khác None = placeholder)
+            cr = cairo.Context(self.surface)
+            cr.set_antialias(cairo.Antialias.BEST)
+            # Nền vòng tròn mờ (hình tròn đầy đủ) + viền ngoài và trong
+            cr.set_source_rgba(0, 0, 0, BG_ALPHA)
+            cr.arc(self.cx, self.cy, self.radius, 0, 2*math.pi)
+            cr.fill()
+            self.stroke_borders(cr)
+        dirty = [i for i in range(n) if self.drawn[i] is not pixbufs[i]]
+        if not dirty:
+            return self.surface
 
-        # Nền vòng tròn mờ (hình tròn đầy đủ)
+        cr = cairo.Context(self.surface)
+        # (tuỳ – khử răng cưa)
+        cr.set_antialias(cairo.Antialias.BEST)
+        for i in dirty:
+            self.draw_sector(cr, sectors[i], pixbufs[i])
+            self.drawn[i] = pixbufs[i]
+        self.surface.flush()
+        return self.surface
+
+    def draw_sector(self, cr, sector, pb):
+        cx, cy = self.cx, self.cy
+        cr.save()
         cr.new_path()
-        cr.set_source_rgba(0, 0, 0, BG_ALPHA)
-        cr.arc(cx, cy, radius, 0, 2*math.pi)
-        cr.fill()
+        cr.append_path(sector["path"])
+        cr.clip()
 
-        # Các miếng
-        for i in range(self.n):
-            a1 = 2*math.pi*i/self.n
-            a2 = 2*math.pi*(i+1)/self.n
-
-            # Path "ring sector"
-            cr.new_path()
-            cr.move_to(cx + inner*math.cos(a1), cy + inner*math.sin(a1))
-            cr.arc(cx, cy, radius, a1, a2)
-            cr.line_to(cx + inner*math.cos(a2), cy + inner*math.sin(a2))
-            cr.arc_negative(cx, cy, inner, a2, a1)
-            cr.close_path()
+        # Nền vòng tròn mờ phía dưới miếng
+        cr.set_operator(cairo.Operator.SOURCE)
+        cr.set_source_rgba(0, 0, 0, BG_ALPHA)
+        cr.paint()
+        cr.set_operator(cairo.Operator.OVER)
 
+        if pb is not None:
+            min_x, min_y, max_x, max_y = sector["bbox"]
+            # Scale ảnh để cover toàn bộ sector (có thể crop)
+            scale = max((max_x - min_x) / pb.get_width(), (max_y - min_y) / pb.get_height()) * 1.1  # Nhân 1.1 để đảm bảo cover hết
             cr.save()
-            cr.clip()
-
-            pb = self.pixbufs[i]
-            if pb is not None:
-                # Tính center của sector hiện tại
-                mid_angle = (a1 + a2) / 2
-
-                # Tính kích thước sector để scale ảnh cover đầy đủ
-                # Sử dụng bounding box của sector để tính scale
-                angle_width = a2 - a1
-
-                # Tính kích thước thực tế của sector (bounding box)
-                # Tìm các điểm góc của sector để tính bounding box
-                points = []
-                # Inner arc points
-                points.append((cx + inner * math.cos(a1), cy + inner * math.sin(a1)))
-                points.append((cx + inner * math.cos(a2), cy + inner * math.sin(a2)))
-                # Outer arc points
-                points.append((cx + radius * math.cos(a1), cy + radius * math.sin(a1)))
-                points.append((cx + radius * math.cos(a2), cy + radius * math.sin(a2)))
-
-                # Thêm một số điểm trung gian trên arc để tính chính xác hơn
-                for j in range(1, 4):
-                    angle = a1 + j * angle_width / 4
-                    points.append((cx + inner * math.cos(angle), cy + inner * math.sin(angle)))
-                    points.append((cx + radius * math.cos(angle), cy + radius * math.sin(angle)))
-
-                # Tính bounding box
-                min_x = min(p[0] for p in points)
-                max_x = max(p[0] for p in points)
-                min_y = min(p[1] for p in points)
-                max_y = max(p[1] for p in points)
-
-                sector_width = max_x - min_x
-                sector_height = max_y - min_y
-
-                # Scale ảnh để cover toàn bộ sector (có thể crop)
-                scale_x = sector_width / pb.get_width()
-                scale_y = sector_height / pb.get_height()
-                scale = max(scale_x, scale_y) * 1.1  # Nhân 1.1 để đảm bảo cover hết
-
-                # Vị trí center sector
-                sector_center_x = (min_x + max_x) / 2
-                sector_center_y = (min_y + max_y) / 2
-
-                # Scale và vẽ ảnh tại center của sector
-                cr.save()
-                cr.translate(sector_center_x, sector_center_y)
-                cr.scale(scale, scale)
-                cr.translate(-pb.get_width() / 2, -pb.get_height() / 2)
-                Gdk.cairo_set_source_pixbuf(cr, pb, 0, 0)
-                cr.paint()
-                cr.restore()
-            else:
-                # Ảnh chưa load hoặc lỗi - hiển thị placeholder
-                cr.set_source_rgb(0.2, 0.2, 0.2)
-                cr.paint()
-
-                # Text "Loading..." nếu ảnh chưa load
-                if i < len(self.current_images):
-                    cr.set_source_rgba(1, 1, 1, 0.8)
-                    cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
-                    cr.set_font_size(14)
-
-                    mid_angle = (a1 + a2) / 2
-                    mid_radius = (radius + inner) / 2
-                    text_x = cx + mid_radius * math.cos(mid_angle)
-                    text_y = cy + mid_radius * math.sin(mid_angle)
-
-                    loading_text = "..."
-                    text_extents = cr.text_extents(loading_text)
-                    cr.move_to(text_x - text_extents.width/2, text_y + text_extents.height/2)
-                    cr.show_text(loading_text)
-
+            cr.translate((min_x + max_x) / 2, (min_y + max_y) / 2)
+            cr.scale(scale, scale)
+            cr.translate(-pb.get_width() / 2, -pb.get_height() / 2)
+            set_source_image(cr, pb, 0, 0)
+            cr.paint()
             cr.restore()
+        else:
+            # Ảnh chưa load hoặc lỗi - hiển thị placeholder
+            cr.set_source_rgb(0.2, 0.2, 0.2)
+            cr.paint()
 
-            # đường phân tách mảnh
-            cr.set_source_rgba(1, 1, 1, 0.18)
-            cr.set_line_width(2.0)
-            cr.move_to(cx + inner*math.cos(a1), cy + inner*math.sin(a1))
-            cr.line_to(cx + radius*math.cos(a1), cy + radius*math.sin(a1))
-            cr.stroke()
+            # Text "Loading..."
+            cr.set_source_rgba(1, 1, 1, 0.8)
+            cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            cr.set_font_size(14)
+            mid_angle = (sector["a1"] + sector["a2"]) / 2
+            mid_radius = (sector["r0"] + sector["r1"]) / 2
+            text_x = cx + mid_radius * math.cos(mid_angle)
+            text_y = cy + mid_radius * math.sin(mid_angle)
+            loading_text = "..."
+            text_extents = cr.text_extents(loading_text)
+            cr.move_to(text_x - text_extents.width/2, text_y + text_extents.height/2)
+            cr.show_text(loading_text)
+
+        # Đường phân tách và viền: vẽ lại phần nằm trong miếng này (vẫn đang clip)
+        self.stroke_borders(cr)
+        cr.restore()
 
-        # Vẽ viền ngoài và trong
+    def stroke_borders(self, cr):
+        """Đường phân tách mảnh, viền ngoài/trong và ranh giới giữa các vòng"""
+        cx, cy, radius = self.cx, self.cy, self.radius
         cr.set_source_rgba(1, 1, 1, 0.18)
         cr.set_line_width(2.0)
+        for s in self.sectors:
+            cr.move_to(cx + s["r0"]*math.cos(s["a1"]), cy + s["r0"]*math.sin(s["a1"]))
+            cr.line_to(cx + s["r1"]*math.cos(s["a1"]), cy + s["r1"]*math.sin(s["a1"]))
+            cr.stroke()
         cr.arc(cx, cy, radius, 0, 2*math.pi)
         cr.stroke()
-        if INNER_HOLE_RATIO > 0:
-            cr.arc(cx, cy, inner, 0, 2*math.pi)
-            cr.stroke()
+        for r0, _, _, _ in self.bands:
+            if r0 > 0:
+                cr.arc(cx, cy, r0, 0, 2*math.pi)
+                cr.stroke()
 
-        # Vẽ hiệu ứng hover sau cùng để không bị ghi đè
-        if self.hovered_sector >= 0 and self.hovered_sector < self.n:
-            i = self.hovered_sector
-            a1 = 2*math.pi*i/self.n
-            a2 = 2*math.pi*(i+1)/self.n
-
-            # Vẽ overlay sáng
-            cr.new_path()
-            cr.move_to(cx + inner*math.cos(a1), cy + inner*math.sin(a1))
-            cr.arc(cx, cy, radius, a1, a2)
-            cr.line_to(cx + inner*math.cos(a2), cy + inner*math.sin(a2))
-            cr.arc_negative(cx, cy, inner, a2, a1)
-            cr.close_path()
-
-            # Overlay đơn giản trước
-            cr.set_source_rgba(1, 1, 1, 0.25)
-            cr.fill_preserve()
-
-            # Viền sáng
-            cr.set_source_rgba(1, 1, 1, 0.8)
-            cr.set_line_width(4.0)
-            cr.stroke()
+    def draw_hover(self, cr, i):
+        """Overlay sáng cho miếng đang hover (chỉ vẽ bên trong miếng)"""
+        cr.save()
+        cr.new_path()
+        cr.append_path(self.sectors[i]["path"])
+        cr.clip_preserve()
+
+        # Overlay đơn giản trước
+        cr.set_source_rgba(1, 1, 1, 0.25)
+        cr.fill_preserve()
+
+        # Viền sáng (nửa trong của nét 8px = 4px)
+        cr.set_source_rgba(1, 1, 1, 0.8)
+        cr.set_line_width(8.0)
+        cr.stroke()
+        cr.restore()
+
+# ---- Main Window ----
+class HudState:
+    """Mọi thứ HUD cần để vẽ: preview đang mở, số trang, chế độ feature, filter.
+
+    RadialPicker giữ một bản (self.hud): phần preview chỉ sống ở đây, phần trang/chế độ/filter
+    được chép sang ngay trước khi vẽ (sync_hud). Không phụ thuộc cửa sổ nên bench dựng thẳng được.
+    """
+    def __init__(self, current_page=0, total_pages=1, modes=(), colour=None, filter_text="", filter_count=""):
+        self.preview_active = False  # True khi đang preview trên canvas
+        self.preview_pixbuf = None   # Pixbuf của ảnh preview (có thể đang decode dở)
+        self.preview_rows = None     # Số hàng đã decode của preview_pixbuf, None = xong
+        self.preview_placeholder = None  # Thumbnail của miếng, hiện ngay trong lúc chờ decode
+        self.preview_image_path = None  # Path của ảnh đang preview
+        self.close_button_rect = None  # Vị trí và kích thước nút đóng preview (draw() ghi lại)
+        self.current_page = current_page
+        self.total_pages = total_pages
+        self.modes = list(modes)     # nhãn các chế độ feature đang bật
+        self.colour = colour         # (r, g, b) của chế độ lọc theo màu
+        self.filter_text = filter_text
+        self.filter_count = filter_count  # "12", "12+" (đang lọc tiếp) hoặc "no match"
+
+    def draw(self, cr, width, height):
+        cx, cy = width/2, height/2
 
         # Vẽ preview overlay nếu đang active
-        if self.preview_active and self.preview_pixbuf:
+        base = self.preview_pixbuf or self.preview_placeholder
+        if self.preview_active and base is not None:
             # Tạo overlay mờ toàn bộ canvas
             cr.set_source_rgba(0, 0, 0, 0.8)
             cr.rectangle(0, 0, width, height)
             cr.fill()
 
             # Vẽ ảnh preview ở center canvas
-            preview_w = self.preview_pixbuf.get_width()
-            preview_h = self.preview_pixbuf.get_height()
+            preview_w = base.get_width()
+            preview_h = base.get_height()
 
             # Scale để fit trong canvas với margin
             canvas_margin = 50
@@ -421,12 +1624,30 @@ class RadialPicker(Gtk.ApplicationWindow):
             preview_x = (width - final_w) / 2
             preview_y = (height - final_h) / 2
 
-            cr.save()
-            cr.translate(preview_x, preview_y)
-            cr.scale(scale, scale)
-            Gdk.cairo_set_source_pixbuf(cr, self.preview_pixbuf, 0, 0)
-            cr.paint()
-            cr.restore()
+            # Thumbnail của miếng (cover khung) lót dưới trong lúc ảnh thật còn đang decode
+            ph = self.preview_placeholder
+            if ph is not None and self.preview_rows is not None:
+                cr.save()
+                cr.rectangle(preview_x, preview_y, final_w, final_h)
+                cr.clip()
+                ph_scale = max(final_w / ph.get_width(), final_h / ph.get_height())
+                cr.translate(preview_x + (final_w - ph.get_width() * ph_scale) / 2,
+                             preview_y + (final_h - ph.get_height() * ph_scale) / 2)
+                cr.scale(ph_scale, ph_scale)
+                set_source_image(cr, ph, 0, 0)
+                cr.paint()
+                cr.restore()
+
+            if self.preview_pixbuf is not None:
+                cr.save()
+                cr.translate(preview_x, preview_y)
+                cr.scale(scale, scale)
+                if self.preview_rows is not None:
+                    cr.rectangle(0, 0, preview_w, self.preview_rows)   # chỉ phần đã decode
+                    cr.clip()
+                Gdk.cairo_set_source_pixbuf(cr, self.preview_pixbuf, 0, 0)
+                cr.paint()
+                cr.restore()
 
             # Vẽ viền cho ảnh preview
             cr.set_source_rgba(1, 1, 1, 0.8)
@@ -550,6 +1771,52 @@ class RadialPicker(Gtk.ApplicationWindow):
             cr.move_to(nav_x, nav_y)
             cr.show_text(nav_text)
 
+        # Chế độ feature đang bật (trên page indicator)
+        modes = self.modes
+        if modes:
+            cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            cr.set_font_size(12)
+            mode_text = " · ".join(modes)
+            text_extents = cr.text_extents(mode_text)
+            swatch = 14 if self.colour is not None else 0
+            text_x = cx - (text_extents.width + swatch) / 2 + swatch
+            text_y = cy - 45
+
+            cr.set_source_rgba(0, 0, 0, 0.8)
+            padding = 6
+            cr.rectangle(text_x - swatch - padding, text_y - text_extents.height - padding,
+                        text_extents.width + swatch + 2*padding, text_extents.height + 2*padding)
+            cr.fill()
+
+            if swatch:
+                r, g, b = self.colour
+                cr.set_source_rgb(r / 255, g / 255, b / 255)
+                cr.rectangle(text_x - swatch, text_y - 10, 10, 10)
+                cr.fill()
+
+            cr.set_source_rgba(1, 1, 1, 0.9)
+            cr.move_to(text_x, text_y)
+            cr.show_text(mode_text)
+
+        # Filter đang gõ (dưới page indicator)
+        if self.filter_text:
+            cr.select_font_face("Sans", cairo.FontSlant.NORMAL, cairo.FontWeight.NORMAL)
+            cr.set_font_size(14)
+            filter_text = f"/{self.filter_text}  ({self.filter_count})"
+            text_extents = cr.text_extents(filter_text)
+            text_x = cx - text_extents.width / 2
+            text_y = cy + 60
+
+            cr.set_source_rgba(0, 0, 0, 0.8)
+            padding = 8
+            cr.rectangle(text_x - padding, text_y - text_extents.height - padding,
+                        text_extents.width + 2*padding, text_extents.height + 2*padding)
+            cr.fill()
+
+            cr.set_source_rgba(1, 1, 1, 1.0)
+            cr.move_to(text_x, text_y)
+            cr.show_text(filter_text)
+
         # Hiển thị indicator khi đang preview
         if self.preview_active:
             cr.set_source_rgba(1, 0.2, 0.2, 0.9)  # Màu đỏ
@@ -573,29 +1840,661 @@ class RadialPicker(Gtk.ApplicationWindow):
             cr.move_to(text_x, text_y)
             cr.show_text(preview_text)
 
+class RadialPicker(Gtk.ApplicationWindow):
+    def __init__(self, app, images, index=None, resident=False, decoder=None):
+        super().__init__(application=app, title="wallpicker")
+        self.resident = resident   # chế độ daemon: đóng = ẩn, giữ nguyên cache
+        self.set_default_size(SIZE, SIZE)
+        self.set_decorated(False)
+        self.set_resizable(False)
+        self.set_modal(True)
+
+        self.images = images
+        self.library = images     # Toàn bộ thư viện
+        self.view = images        # Thư viện sau chế độ bỏ trùng / theo màu
+        self.all_images = images  # Ảnh đang duyệt (= view khi không lọc)
+        self.filter_text = ""     # Gõ tên file để lọc (fuzzy)
+        self.filter_match = None  # FuzzyMatch của filter_text
+        self.fuzzy = None         # FuzzyIndex của view, dựng ở lần lọc đầu
+
+        # Chế độ dựa trên pHash / màu chủ đạo (cần NumPy)
+        self.features = None         # FeatureIndex, nạp khi bật chế độ đầu tiên
+        self.features_busy = False   # đang tính feature ở luồng nền
+        self.duplicates_pending = None  # key của lần tìm ảnh trùng đang chạy ở luồng nền
+        self.hide_duplicates = False
+        self.colour_sort = False
+        self.colour_filter = None    # (r, g, b) khi lọc theo màu
+        self.page_size = LAYOUT.page_size  # Số ảnh tối đa mỗi trang (tổng các vòng)
+        self.index = index
+        self.current_page = 0
+        self.total_pages = max(1, math.ceil(len(images) / self.page_size))
+
+        # Lấy ảnh cho trang hiện tại
+        self.current_images = self.get_current_page_images()
+        self.n = len(self.current_images)
+        self.hovered_sector = -1  # Track which sector is hovered
+
+        # Hover preview variables
+        self.hover_timer_id = None
+        self.hover_start_time = 0
+        self.hud = HudState()        # preview đang mở + những gì HUD vẽ
+        self.preview_cancel = None   # Gio.Cancellable của lần decode preview hiện tại
+
+        TRACE.event("page", f"Page {self.current_page + 1}/{self.total_pages} ({len(self.current_images)} images)",
+                    page=self.current_page, total=self.total_pages)
+
+        # Canvas size cho việc scale ảnh để cover toàn bộ
+        self.canvas_size = SIZE
+
+        self.pixbufs = [None] * self.page_size  # Khởi tạo list với page_size
+        self.load_cache = PixbufLRU(MEM_CACHE_MB * 1024 * 1024)  # (path, target) -> pixbuf, dùng lại khi lật trang
+        self.loader = ImageLoader(stat_of=index.stat if index else None, decoder=decoder)
+        self.renderer = RingRenderer()
+
+        # Vùng cần vẽ lại, gom theo frame clock (xem invalidate/on_tick)
+        self.dirty_sectors = set()
+        self.dirty_ring = False
+        self.dirty_hud = False
+        self.tick_id = None
+        self.loaded_count = 0
+
+        # Setup UI trước
+        self.setup_ui()
+
+        # Bắt đầu load ảnh trong background
+        self.load_page()
+
+    def thumb_targets(self, n=None):
+        """Kích thước thumbnail cần cho từng miếng của trang có n ảnh (mặc định: trang hiện tại)"""
+        return page_thumb_targets(self.n if n is None else n, self.canvas_size)
+
+    def page_images(self, page):
+        """Lấy danh sách ảnh của trang page"""
+        start_idx = page * self.page_size
+        end_idx = start_idx + self.page_size
+        return self.all_images[start_idx:end_idx]
+
+    def get_current_page_images(self):
+        """Lấy danh sách ảnh cho trang hiện tại"""
+        return self.page_images(self.current_page)
+
+    def go_to_page(self, page):
+        """Chuyển sang trang page"""
+        self.cancel_hover_timer()
+        self.clear_preview()
+        self.current_page = page
+        self.current_images = self.get_current_page_images()
+        self.n = len(self.current_images)
+        self.hovered_sector = -1
+        self.pixbufs = [None] * self.page_size  # Reset pixbufs cho trang mới
+        self.loaded_count = 0
+        self.renderer.invalidate()
+        self.layout_tiles()
+        self.load_page()
+        TRACE.event("page", f"Page {self.current_page + 1}/{self.total_pages}", page=self.current_page, total=self.total_pages)
+        self.invalidate(*range(self.n), ring=True, hud=True)
+
+    def set_images(self, images, force=False):
+        """Thay danh sách ảnh (quét xong / stream thêm), giữ trang hiện tại nếu nội dung không đổi"""
+        self.library = images
+        self.view = self.library_view()
+        self.fuzzy = None
+        if self.filter_text:
+            self.filter_match = self.fuzzy_index().query(self.filter_text)
+        images = self.filtered_images()
+        self.all_images = images
+        self.total_pages = max(1, math.ceil(len(images) / self.page_size))
+        page = min(self.current_page, self.total_pages - 1)
+        if force or page != self.current_page or self.page_images(page) != self.current_images:
+            self.go_to_page(page)
+        else:
+            self.invalidate(hud=True)   # chỉ số trang tổng thay đổi
+
+    def library_view(self):
+        """Thư viện sau các chế độ feature: bỏ ảnh trùng, lọc gần màu, sắp theo màu"""
+        images = self.library
+        f = self.features
+        if f is None or not (self.hide_duplicates or self.colour_filter or self.colour_sort):
+            return images
+        with TRACE.span("library_view"):
+            if self.hide_duplicates:
+                hidden = self.hidden_duplicates(images)
+                images = [p for p in images if p not in hidden]
+            if self.colour_filter is not None:
+                images = f.near_colour(images, self.colour_filter)
+            elif self.colour_sort:
+                images = f.sort_by_colour(images)
+        return images
+
+    def hidden_duplicates(self, images):
+        """Ảnh trùng cần ẩn nếu đã tính cho đúng thư viện này; chưa thì tính ở luồng nền rồi view tự cập nhật"""
+        job = self.features.duplicates_job(images)
+        hidden = self.features.cached_duplicates(job[0])
+        if hidden is not None:
+            return hidden
+        if self.duplicates_pending != job[0]:
+            self.duplicates_pending = job[0]
+            self.invalidate(hud=True)
+            threading.Thread(target=self.duplicates_worker, args=(job,), daemon=True).start()
+        return set()
+
+    def duplicates_worker(self, job):
+        key, known, hashes, ranks = job
+        with TRACE.span("duplicates"):
+            hidden = find_duplicates(known, hashes, ranks, FeatureIndex.DUP_DISTANCE)
+        GLib.idle_add(self.on_duplicates_ready, key, hidden)
+
+    def on_duplicates_ready(self, key, hidden):
+        self.features.store_duplicates(key, hidden)
+        if key == self.duplicates_pending:
+            self.duplicates_pending = None
+            if self.hide_duplicates:
+                self.set_images(self.library)   # giữ trang hiện tại
+            else:
+                self.invalidate(hud=True)
+        return False
+
+    def refresh_view(self):
+        """Đổi chế độ: dựng lại view, áp lại filter tên rồi về trang đầu"""
+        self.view = self.library_view()
+        self.fuzzy = None
+        self.set_filter(self.filter_text)
+
+    def set_mode(self, **modes):
+        """Bật/tắt chế độ feature; feature còn thiếu được tính ở luồng nền rồi view tự cập nhật"""
+        if np is None:
+            TRACE.event("features_unavailable", "NumPy not installed: duplicate/colour modes disabled")
+            return
+        for name, value in modes.items():
+            setattr(self, name, value)
+        if self.features is None:
+            root = self.index.root if self.index else WALL_DIR
+            self.features = FeatureIndex(root)
+        self.refresh_view()
+        self.ensure_features()
+
+    def ensure_features(self):
+        if not self.features_busy and self.features.missing(self.library, self.index.stat if self.index else None):
+            self.features_busy = True
+            self.invalidate(hud=True)
+            threading.Thread(target=self.features_worker, args=(list(self.library),), daemon=True).start()
+
+    def features_worker(self, images):
+        entries = self.features.compute(images, self.index.stat if self.index else None)
+        GLib.idle_add(self.on_features_ready, entries)
+
+    def on_features_ready(self, entries):
+        self.features_busy = False
+        self.features.merge(entries)
+        self.invalidate(hud=True)
+        TRACE.event("features_done", f"Features ready ({len(entries)} new)", count=len(entries))
+        if self.hide_duplicates or self.colour_sort or self.colour_filter is not None:
+            self.refresh_view()
+        return False
+
+    def fuzzy_index(self):
+        if self.fuzzy is None:
+            with TRACE.span("fuzzy_index"):
+                self.fuzzy = FuzzyIndex(self.view)
+        return self.fuzzy
+
+    def filtered_images(self):
+        """Ảnh khớp filter hiện tại; chỉ tính đủ cho trang đầu, phần còn lại extend_filter tính ở idle"""
+        if self.filter_match is None:
+            return self.view
+        ids = self.filter_match.ensure(self.page_size)
+        if not self.filter_match.done:
+            GLib.idle_add(self.extend_filter, self.filter_match)
+        return [self.view[i] for i in ids]
+
+    def extend_filter(self, match):
+        """Idle: tính tiếp kết quả lọc theo từng đợt, cập nhật số trang"""
+        if match is not self.filter_match:
+            return False   # đã gõ tiếp / thư viện đổi
+        start = len(match.ids)
+        match.ensure(start + 4096)
+        self.all_images.extend(self.view[i] for i in match.ids[start:])
+        self.total_pages = max(1, math.ceil(len(self.all_images) / self.page_size))
+        self.invalidate(hud=True)
+        return not match.done
+
+    def set_filter(self, text):
+        """Lọc thư viện theo tên file rồi về trang đầu của kết quả"""
+        self.filter_text = text
+        with TRACE.span("filter"):
+            self.filter_match = self.fuzzy_index().query(text) if text else None
+            self.all_images = self.filtered_images()
+        self.total_pages = max(1, math.ceil(len(self.all_images) / self.page_size))
+        TRACE.event("filter", None, query=text, matches=len(self.all_images))
+        self.go_to_page(0)
+
+    def on_library_changed(self, added, removed):
+        """WallWatcher báo thư mục thay đổi: cập nhật danh sách đã sắp xếp mà không quét lại"""
+        current = set(self.current_images)
+        touched = False
+        for path, (mtime, size) in removed:
+            touched = touched or path in current
+            for target in set(self.load_cache.discard_path(path)) | set(self.thumb_targets()) | set(ATLASES):
+                key = THUMBS.key(path, mtime, size, target)
+                THUMBS.discard(key)
+                if ATLASES.get(target) is not None:
+                    ATLASES[target].discard(key)
+        images = merge_changes(self.library, added, removed)
+        TRACE.event("library_changed", f"Library changed: +{len(added)} -{len(removed)}", added=len(added), removed=len(removed))
+        self.set_images(images, force=touched)
+        if added and self.features is not None:
+            self.ensure_features()
+
+    def close_picker(self):
+        """Đóng picker: chế độ daemon chỉ ẩn cửa sổ, còn lại thì destroy"""
+        if not self.resident:
+            self.destroy()
+            return
+        self.cancel_hover_timer()
+        self.clear_preview()
+        self.invalidate(self.hovered_sector, hud=True)
+        self.hovered_sector = -1
+        if self.colour_filter is not None:
+            self.colour_filter = None
+            self.view = self.library_view()
+            self.fuzzy = None
+        if self.filter_text or self.all_images is not self.view:
+            self.set_filter("")   # lần mở sau thấy cả thư viện
+        self.set_visible(False)
+
+    def on_close_request(self, win):
+        if self.resident:
+            self.close_picker()
+            return True   # chặn destroy
+        return False
+
+    def next_page(self):
+        """Chuyển sang trang tiếp theo"""
+        if self.current_page < self.total_pages - 1:
+            self.go_to_page(self.current_page + 1)
+
+    def prev_page(self):
+        """Chuyển sang trang trước"""
+        if self.current_page > 0:
+            self.go_to_page(self.current_page - 1)
+
+    def load_page(self):
+        """Lấy ngay ảnh đã có trong RAM, load phần còn thiếu và prefetch 2 trang kề"""
+        gen = self.loader.new_generation()   # huỷ job của trang trước
+        missing = []
+        for i, (path, target) in enumerate(zip(self.current_images, self.thumb_targets())):
+            pb = self.load_cache.get((path, target)) or self.atlas_tile(path, target)
+            if pb is not None:
+                self.pixbufs[i] = pb
+                self.loaded_count += 1
+            else:
+                missing.append((i, path, target))
+
+        prefetch = []
+        for page in (self.current_page + 1, self.current_page - 1):
+            if 0 <= page < self.total_pages:
+                imgs = self.page_images(page)
+                prefetch += [(path, t) for path, t in zip(imgs, self.thumb_targets(len(imgs)))
+                             if (path, t) not in self.load_cache and not self.in_atlas(path, t)]
+
+        self.load_images_async(gen, missing, prefetch)
+
+    def atlas_key(self, path, target):
+        stat = self.index.stat(path) if self.index else None
+        try:
+            return thumb_key(path, target, stat)
+        except OSError:
+            return None
+
+    def atlas_tile(self, path, target):
+        """Tile đã pack sẵn trong atlas (chỉ bọc vùng mmap, không I/O), hoặc None"""
+        atlas = atlas_for(target)
+        key = atlas and self.atlas_key(path, target)
+        return atlas.get(key) if key else None
+
+    def in_atlas(self, path, target):
+        atlas = atlas_for(target)
+        key = atlas and self.atlas_key(path, target)
+        return bool(key) and key in atlas
+
+    def load_images_async(self, gen, images, prefetch=()):
+        """Đưa ảnh (index, path, target) vào loader chung; prefetch (path, target) xếp sau với ưu tiên thấp"""
+        TRACE.event("load", f"Loading {len(images)} images in background...", count=len(images), prefetch=len(prefetch))
+        for i, path, target in images:
+            self.loader.submit(gen, (ImageLoader.PRIO_VISIBLE, i), path, target, self.on_image_loaded, i)
+        for rank, (path, size) in enumerate(prefetch):
+            self.loader.submit(gen, (ImageLoader.PRIO_PREFETCH, rank), path, size, self.on_image_loaded)
+
+    def on_image_loaded(self, gen, index, path, target, pixbuf):
+        """Callback khi một ảnh được load xong (index None = ảnh prefetch)"""
+        if gen != self.loader.generation:
+            return False  # trang đã đổi trong lúc chờ main loop
+        if pixbuf is not None and not isinstance(pixbuf, cairo.ImageSurface):
+            # Tile atlas không giữ trong LRU: slot có thể bị ghi đè, lấy lại từ atlas khi cần
+            self.load_cache.put((path, target), pixbuf)
+        if index is not None and index < len(self.current_images) and self.current_images[index] == path:
+            self.pixbufs[index] = pixbuf
+            self.loaded_count += 1
+
+            # Progress update
+            if self.loaded_count % 3 == 0 or self.loaded_count == len(self.current_images):
+                TRACE.event("loaded", f"Loaded {self.loaded_count}/{len(self.current_images)} images",
+                            loaded=self.loaded_count, total=len(self.current_images))
+            if self.loaded_count == len(self.current_images):
+                TRACE.mark("first_full_page")
+
+            # Chỉ vẽ lại miếng vừa có ảnh, gom theo frame
+            self.invalidate(index)
+        return False  # Remove from idle queue
+
+    def start_hover_timer(self, sector_idx):
+        """Bắt đầu timer cho hover preview"""
+        if self.hover_timer_id:
+            GLib.source_remove(self.hover_timer_id)
+
+        def on_hover_timeout():
+            if (self.hovered_sector == sector_idx and
+                sector_idx < len(self.current_images) and
+                not self.hud.preview_active):
+
+                # Preview trên canvas: thumbnail của miếng hiện ngay, ảnh thật decode ở luồng nền
+                preview_path = self.current_images[sector_idx]
+                self.clear_preview()
+                self.hud.preview_image_path = str(preview_path)
+                self.hud.preview_placeholder = self.pixbufs[sector_idx]
+                self.hud.preview_rows = 0
+                self.preview_cancel = Gio.Cancellable()
+                threading.Thread(target=self.preview_worker, args=(preview_path, self.preview_cancel),
+                                 daemon=True).start()
+                if self.hud.preview_placeholder is not None:
+                    self.show_preview()
+
+            self.hover_timer_id = None
+            return False  # Remove timer
+
+        # Set timer cho 1.5 giây
+        self.hover_timer_id = GLib.timeout_add(1500, on_hover_timeout)
+
+    def cancel_hover_timer(self):
+        """Hủy hover timer"""
+        if self.hover_timer_id:
+            GLib.source_remove(self.hover_timer_id)
+            self.hover_timer_id = None
+
+    def clear_preview(self):
+        """Tắt preview và huỷ decode đang chạy"""
+        if self.preview_cancel is not None:
+            self.preview_cancel.cancel()
+        self.preview_cancel = None
+        self.hud.preview_active = False
+        self.hud.preview_pixbuf = None
+        self.hud.preview_rows = None
+        self.hud.preview_placeholder = None
+        self.hud.preview_image_path = None
+        self.hud.close_button_rect = None
+
+    def show_preview(self):
+        self.hud.preview_active = True
+        TRACE.event("preview", f"Canvas preview: {self.hud.preview_image_path}", path=self.hud.preview_image_path)
+
+        # Đảm bảo area có focus để nhận keyboard input
+        self.area.grab_focus()
+
+        # Redraw để hiển thị preview trên canvas
+        self.invalidate(hud=True)
+
+    def preview_worker(self, path, cancellable):
+        """Luồng nền: decode ảnh preview (cover SIZE) qua PixbufLoader theo từng đoạn file,
+        gửi bản đang dở về main loop vài lần mỗi giây; dừng ngay khi bị huỷ"""
+        try:
+            key = thumb_key(path, SIZE, self.index.stat(path) if self.index else None)
+            with TRACE.span("preview_thumb_read"):
+                pb = THUMBS.get(key)
+            if pb is not None:
+                GLib.idle_add(self.on_preview_update, cancellable, pb, None)
+                return
+            rows = [0]
+            loader = GdkPixbuf.PixbufLoader()
+
+            def on_size_prepared(loader, w, h):
+                neww, newh = cover_size(w, h, SIZE)
+                if neww < w:
+                    loader.set_size(neww, newh)   # loader tự thu nhỏ khi decode (JPEG: DCT scaling)
+
+            def on_area_updated(loader, x, y, w, h):
+                rows[0] = max(rows[0], y + h)
+            loader.connect("size-prepared", on_size_prepared)
+            loader.connect("area-updated", on_area_updated)
+
+            with TRACE.span("preview_decode"), open(path, "rb") as f:
+                sent = 0
+                while not cancellable.is_cancelled():
+                    chunk = f.read(PREVIEW_CHUNK)
+                    if not chunk:
+                        break
+                    loader.write(chunk)
+                    now = time.monotonic()
+                    partial = loader.get_pixbuf()
+                    if partial is not None and rows[0] and now - sent > PREVIEW_REFRESH_S:
+                        sent = now
+                        GLib.idle_add(self.on_preview_update, cancellable, partial.copy(), rows[0])
+                try:
+                    loader.close()
+                except GLib.Error:
+                    if not cancellable.is_cancelled():
+                        raise
+            if cancellable.is_cancelled():
+                return
+            pb = loader.get_pixbuf()
+            if pb is None:   # file rỗng hoặc loader không nhận ra định dạng
+                print(f"[wallpicker] preview skip {path}: no image data", file=sys.stderr)
+                return
+            neww, newh = cover_size(pb.get_width(), pb.get_height(), SIZE)
+            if neww > pb.get_width():
+                pb = pb.scale_simple(neww, newh, GdkPixbuf.InterpType.BILINEAR)   # như decode_at_size
+            THUMBS.put(key, pb)
+            GLib.idle_add(self.on_preview_update, cancellable, pb, None)
+        except (OSError, GLib.Error) as e:
+            print(f"[wallpicker] preview skip {path}: {e}", file=sys.stderr)
+
+    def on_preview_update(self, cancellable, pixbuf, rows):
+        """Main loop: thay ảnh preview bằng bản mới hơn (rows None = đã decode xong)"""
+        if cancellable is not self.preview_cancel or cancellable.is_cancelled():
+            return False
+        self.hud.preview_pixbuf = pixbuf
+        self.hud.preview_rows = rows
+        if rows is None:
+            self.preview_cancel = None
+        if not self.hud.preview_active:
+            self.show_preview()
+        else:
+            self.invalidate(hud=True)
+        return False
+
+    def setup_ui(self):
+        """Setup UI elements"""
+        # Vẽ: lớp nền (vòng + nhận input), mỗi miếng một tile riêng, trên cùng là HUD (số trang, preview).
+        # GTK4 không có queue_draw_area nên tách widget để damage chỉ nằm trong bbox của miếng thay đổi.
+        self.area = Gtk.DrawingArea()
+        self.area.set_content_width(SIZE)
+        self.area.set_content_height(SIZE)
+        self.area.set_draw_func(self.on_draw_ring)
+        overlay = Gtk.Overlay()
+        overlay.set_child(self.area)
+
+        self.tiles = []
+        for i in range(self.page_size):
+            tile = Gtk.DrawingArea()
+            tile.set_can_target(False)
+            tile.set_halign(Gtk.Align.START)
+            tile.set_valign(Gtk.Align.START)
+            tile.set_draw_func(self.on_draw_sector, i)
+            overlay.add_overlay(tile)
+            self.tiles.append(tile)
+        self.layout_tiles()
+
+        self.hud = Gtk.DrawingArea()
+        self.hud.set_can_target(False)
+        self.hud.set_draw_func(self.on_draw)
+        overlay.add_overlay(self.hud)
+        self.set_child(overlay)
+
+        # Click
+        click = Gtk.GestureClick()
+        click.connect("released", self.on_released)
+        self.area.add_controller(click)
+
+        # Chuột phải vào miếng: lọc các ảnh cùng tông màu
+        colour_click = Gtk.GestureClick()
+        colour_click.set_button(Gdk.BUTTON_SECONDARY)
+        colour_click.connect("released", self.on_colour_click)
+        self.area.add_controller(colour_click)
+
+        # Mouse motion để detect hover
+        motion = Gtk.EventControllerMotion()
+        motion.connect("motion", self.on_motion)
+        motion.connect("leave", self.on_leave)
+        self.area.add_controller(motion)
+
+        # Keyboard để navigation
+        key = Gtk.EventControllerKey()
+        key.connect("key-pressed", self.on_key_pressed)
+        self.area.add_controller(key)
+
+        # Focus để nhận keyboard input
+        self.area.set_can_focus(True)
+        self.area.grab_focus()
+
+        self.connect("close-request", self.on_close_request)
+
+    def layout_tiles(self):
+        """Đặt mỗi tile đúng bounding box của miếng tương ứng"""
+        sectors = self.renderer.geometry(self.canvas_size, self.canvas_size, self.n)
+        for i, tile in enumerate(self.tiles):
+            if i >= self.n:
+                tile.set_visible(False)
+                continue
+            x0, y0, x1, y1 = sectors[i]["bbox"]
+            x0, y0 = max(0, int(x0) - 1), max(0, int(y0) - 1)
+            tile.set_margin_start(x0)
+            tile.set_margin_top(y0)
+            tile.set_content_width(math.ceil(x1) + 1 - x0)
+            tile.set_content_height(math.ceil(y1) + 1 - y0)
+            tile.set_visible(True)
+
+    def invalidate(self, *sectors, ring=False, hud=False):
+        """Đánh dấu vùng cần vẽ lại; gom lại và vẽ một lần ở frame kế tiếp"""
+        self.dirty_sectors.update(i for i in sectors if 0 <= i < self.n)
+        self.dirty_ring = self.dirty_ring or ring
+        self.dirty_hud = self.dirty_hud or hud
+        if self.tick_id is None and hasattr(self, 'area'):
+            self.tick_id = self.area.add_tick_callback(self.on_tick)
+
+    def on_tick(self, widget, frame_clock):
+        """Tick của frame clock: queue_draw đúng những widget bẩn rồi tự gỡ"""
+        if self.dirty_ring:
+            self.area.queue_draw()
+        for i in self.dirty_sectors:
+            self.tiles[i].queue_draw()
+        if self.dirty_hud:
+            self.hud.queue_draw()
+        self.dirty_sectors.clear()
+        self.dirty_ring = self.dirty_hud = False
+        self.tick_id = None
+        return GLib.SOURCE_REMOVE
+
+    def on_draw_ring(self, area, cr: cairo.Context, width, height):
+        """Lớp nền: vòng ảnh đã ghép sẵn (chỉ vẽ lại khi đổi trang)"""
+        with TRACE.span("draw_ring"):
+            ring = self.renderer.ring(self.canvas_size, self.canvas_size, self.n, self.pixbufs, area.get_scale_factor())
+            cr.set_source_surface(ring, 0, 0)
+            cr.paint()
+        TRACE.mark("first_draw")
+
+    def on_draw_sector(self, tile, cr: cairo.Context, width, height, i):
+        """Tile của miếng i: blit phần vòng đã ghép sẵn + overlay hover"""
+        if i >= self.n:
+            return
+        with TRACE.span("draw_sector"):
+            ring = self.renderer.ring(self.canvas_size, self.canvas_size, self.n, self.pixbufs, tile.get_scale_factor())
+            cr.translate(-tile.get_margin_start(), -tile.get_margin_top())
+            cr.save()
+            cr.append_path(self.renderer.sectors[i]["path"])
+            cr.clip()
+            cr.set_source_surface(ring, 0, 0)
+            cr.paint()
+            cr.restore()
+            if i == self.hovered_sector:
+                self.renderer.draw_hover(cr, i)
+
+    def on_draw(self, area, cr: cairo.Context, width, height):
+        """HUD: preview và page indicator"""
+        with TRACE.span("draw_hud"):
+            self.draw_hud(cr, width, height)
+
+    def draw_hud(self, cr, width, height):
+        self.sync_hud()
+        self.hud.draw(cr, width, height)
+
+    def sync_hud(self):
+        """Chép trang, chế độ feature và filter sang HudState ngay trước khi vẽ"""
+        hud = self.hud
+        hud.current_page, hud.total_pages = self.current_page, self.total_pages
+        hud.modes = [label for on, label in ((self.hide_duplicates, "no duplicates"), (self.colour_sort, "by colour"),
+                                             (self.colour_filter is not None, "colour"),
+                                             (self.features_busy or self.duplicates_pending is not None, "indexing..."))
+                     if on]
+        hud.colour = self.colour_filter
+        hud.filter_text = self.filter_text
+        if self.filter_text:
+            pending = self.filter_match is not None and not self.filter_match.done
+            hud.filter_count = f"{len(self.all_images)}{'+' if pending else ''}" if self.all_images else "no match"
+
     def on_key_pressed(self, controller, keyval, keycode, state):
         """Xử lý keyboard input"""
         if keyval == Gdk.KEY_Escape:
-            if self.preview_active:
+            if self.hud.preview_active:
                 # ESC khi preview: tắt preview
-                self.preview_active = False
-                self.preview_pixbuf = None
-                self.preview_image_path = None
-                self.close_button_rect = None
-                self.area.queue_draw()
+                self.clear_preview()
+                self.invalidate(hud=True)
+                return True
+            elif self.filter_text:
+                # ESC khi đang lọc: bỏ filter
+                self.set_filter("")
+                return True
+            elif self.colour_filter is not None:
+                self.set_mode(colour_filter=None)
                 return True
             else:
                 # ESC bình thường: tắt app
-                self.destroy()
+                self.close_picker()
                 return True
         elif keyval == Gdk.KEY_Right or keyval == Gdk.KEY_space:
-            if not self.preview_active:  # Chỉ chuyển trang khi không preview
+            if not self.hud.preview_active:  # Chỉ chuyển trang khi không preview
                 self.next_page()
                 return True
         elif keyval == Gdk.KEY_Left:
-            if not self.preview_active:  # Chỉ chuyển trang khi không preview
+            if not self.hud.preview_active:  # Chỉ chuyển trang khi không preview
                 self.prev_page()
                 return True
+        elif state & Gdk.ModifierType.CONTROL_MASK and keyval in (Gdk.KEY_d, Gdk.KEY_D):
+            # Ctrl+D: ẩn/hiện ảnh trùng (pHash)
+            self.set_mode(hide_duplicates=not self.hide_duplicates)
+            return True
+        elif state & Gdk.ModifierType.CONTROL_MASK and keyval in (Gdk.KEY_s, Gdk.KEY_S):
+            # Ctrl+S: sắp theo màu chủ đạo
+            self.set_mode(colour_sort=not self.colour_sort)
+            return True
+        elif keyval == Gdk.KEY_BackSpace:
+            if not self.hud.preview_active and self.filter_text:
+                self.set_filter(self.filter_text[:-1])
+                return True
+        elif not self.hud.preview_active and not state & (Gdk.ModifierType.CONTROL_MASK | Gdk.ModifierType.ALT_MASK):
+            # Gõ ký tự: thêm vào filter tên file
+            ch = chr(Gdk.keyval_to_unicode(keyval))
+            if ch.isprintable() and not ch.isspace():
+                self.set_filter(self.filter_text + ch)
+                return True
         return False
 
     def on_released(self, gesture, n_press, x, y):
@@ -608,94 +2507,89 @@ class RadialPicker(Gtk.ApplicationWindow):
         inner = radius * INNER_HOLE_RATIO
 
         # Nếu đang preview, kiểm tra click vào nút X trước
-        if self.preview_active:
+        if self.hud.preview_active:
             # Kiểm tra click vào nút X
-            if self.close_button_rect:
-                close_x, close_y, close_w, close_h = self.close_button_rect
+            if self.hud.close_button_rect:
+                close_x, close_y, close_w, close_h = self.hud.close_button_rect
                 if (close_x <= x <= close_x + close_w and
                     close_y <= y <= close_y + close_h):
                     # Click vào nút X - tắt preview
-                    self.preview_active = False
-                    self.preview_pixbuf = None
-                    self.preview_image_path = None
-                    self.close_button_rect = None
-                    self.area.queue_draw()
-                    print("[wallpicker] Preview closed via X button")
+                    self.clear_preview()
+                    self.invalidate(hud=True)
+                    TRACE.event("preview_closed", "Preview closed via X button")
                     return
 
             # Click khác khi preview - set wallpaper và tắt app
-            if self.preview_image_path:
-                wp = str(self.preview_image_path)
-                ensure_swww()
-                subprocess.run([
-                    "swww", "img", wp,
-                    "--transition-type", "any",
-                    "--transition-fps", "60",
-                    "--transition-duration", "0.6"
-                ])
-                print(f"[wallpicker] Set wallpaper: {wp}")
-            self.destroy()
+            if self.hud.preview_image_path:
+                self.apply_wallpaper(self.hud.preview_image_path)
+            self.close_picker()
             return
 
         # Kiểm tra click vào navigation arrows trước
         if self.total_pages > 1:
             # Click vào mũi tên trái (area rộng hơn)
             if (dx >= -90 and dx <= -40 and abs(dy) < 30 and self.current_page > 0):
-                print(f"[DEBUG] Clicked left arrow")
+                TRACE.event("click", "Clicked left arrow", target="prev")
                 self.prev_page()
                 return
             # Click vào mũi tên phải (area rộng hơn)
             elif (dx >= 30 and dx <= 80 and abs(dy) < 30 and self.current_page < self.total_pages - 1):
-                print(f"[DEBUG] Clicked right arrow")
+                TRACE.event("click", "Clicked right arrow", target="next")
                 self.next_page()
                 return
 
         # Click bên ngoài circle -> đóng
         if r < inner or r > radius:
-            self.destroy()
+            self.close_picker()
             return
 
         # Click vào sector -> chọn wallpaper
-        angle = math.atan2(dy, dx) % (2*math.pi)
-        idx = int(angle / (2*math.pi) * self.n)
-        if idx < len(self.current_images):
-            wp = str(self.current_images[idx])
-
-            ensure_swww()
-            subprocess.run([
-                "swww", "img", wp,
-                "--transition-type", "any",
-                "--transition-fps", "60",
-                "--transition-duration", "0.6"
-            ])
-            self.destroy()
+        idx = self.get_sector_at_position(x, y)
+        if 0 <= idx < len(self.current_images):
+            self.apply_wallpaper(self.current_images[idx])
+            self.close_picker()
+
+    def apply_wallpaper(self, path):
+        """Giao cho WallpaperSetter của App (chạy nền); cửa sổ đóng ngay, không chờ swww"""
+        self.get_application().setter.apply(path)
+
+    def on_colour_click(self, gesture, n_press, x, y):
+        """Lọc theo màu chủ đạo của ảnh dưới chuột; bấm lần nữa thì bỏ lọc"""
+        if self.hud.preview_active or np is None:
+            return
+        if self.colour_filter is not None:
+            self.set_mode(colour_filter=None)
+            return
+        idx = self.get_sector_at_position(x, y)
+        if not 0 <= idx < len(self.current_images):
+            return
+        path = self.current_images[idx]
+        if self.features is None:
+            self.features = FeatureIndex(self.index.root if self.index else WALL_DIR)
+        if self.features.get(path) is None:
+            self.features.merge(self.features.compute(self.library, self.index.stat if self.index else None, only={path}))
+        entry = self.features.get(path)
+        if entry is not None:
+            TRACE.event("colour_filter", f"Filter by colour of {path.name}", colour=entry[3])
+            self.set_mode(colour_filter=tuple(entry[3]))
 
     def get_sector_at_position(self, x, y):
         """Trả về index của sector tại vị trí (x, y), hoặc -1 nếu không trong sector nào"""
-        width = self.area.get_allocated_width()
-        height = self.area.get_allocated_height()
-        cx, cy = width/2, height/2
-        dx, dy = x - cx, y - cy
-        r = math.hypot(dx, dy)
-        radius = min(width, height)/2
-        inner = radius * INNER_HOLE_RATIO
-
-        if r < inner or r > radius:
-            return -1
-
-        angle = math.atan2(dy, dx) % (2*math.pi)
-        idx = int(angle / (2*math.pi) * self.n)
-        return idx
+        self.renderer.geometry(self.canvas_size, self.canvas_size, self.n)
+        return self.renderer.sector_at(x, y)
 
     def on_motion(self, controller, x, y):
         """Xử lý mouse motion để highlight sector và bắt đầu hover timer"""
         new_sector = self.get_sector_at_position(x, y)
         if new_sector != self.hovered_sector:
-            # Cancel timer cũ
+            # Cancel timer cũ (và decode preview chưa kịp hiện)
             self.cancel_hover_timer()
+            if self.preview_cancel is not None and not self.hud.preview_active:
+                self.clear_preview()
 
+            # Chỉ vẽ lại miếng cũ và miếng mới
+            self.invalidate(self.hovered_sector, new_sector)
             self.hovered_sector = new_sector
-            self.area.queue_draw()  # Redraw để update highlight
 
             # Bắt đầu timer mới nếu hover vào sector hợp lệ
             if new_sector >= 0 and new_sector < len(self.current_images):
@@ -705,33 +2599,303 @@ class RadialPicker(Gtk.ApplicationWindow):
         """Xử lý khi mouse leave khỏi widget"""
         self.cancel_hover_timer()
         if self.hovered_sector != -1:
+            self.invalidate(self.hovered_sector)
             self.hovered_sector = -1
-            self.area.queue_draw()
 
         # Tắt preview khi mouse leave (tuỳ chọn)
-        # if self.preview_active:
-        #     self.preview_active = False
-        #     self.preview_pixbuf = None
-        #     self.preview_image_path = None
+        # if self.hud.preview_active:
+        #     self.hud.preview_active = False
+        #     self.hud.preview_pixbuf = None
+        #     self.hud.preview_image_path = None
         #     self.area.queue_draw()
 
 # ---- App ----
 class App(Gtk.Application):
-    def __init__(self):
+    def __init__(self, daemon=False, backend=DECODE_BACKEND):
         super().__init__(application_id="dev.huan.wallpicker")
+        self.decoder = make_decoder(backend)
+        self.setter = WallpaperSetter(self)
+        self.daemon = daemon        # giữ process + cửa sổ thường trú, activate = bật/tắt
+        self.launched = False       # activate đầu tiên của daemon là chính lần khởi động, không hiện
+        self.win = None
+        self.want_picker = False    # cần hiện picker ngay khi có ảnh
+        self.index = None
+        self.images = []
+        self.watcher = None
+
+    def do_startup(self):
+        Gtk.Application.do_startup(self)
+        TRACE.mark("gtk_startup")
+
+        # ---- CSS: nền trong suốt ----
+        provider = Gtk.CssProvider()
+        provider.load_from_data(b"""
+        window, .background { background-color: transparent; }
+        """)
+        Gtk.StyleContext.add_provider_for_display(
+            Gdk.Display.get_default(),
+            provider,
+            Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION
+        )
+
+        # Client nhẹ: gdbus call ... org.gtk.Actions.Activate toggle [] {}
+        toggle = Gio.SimpleAction.new("toggle", None)
+        toggle.connect("activate", lambda action, param: self.toggle())
+        self.add_action(toggle)
+
+        if self.daemon:
+            self.hold()   # sống tiếp khi không có cửa sổ nào hiện
+            self.start_scan()
+
+    def do_shutdown(self):
+        save_atlases()
+        Gtk.Application.do_shutdown(self)
 
     def do_activate(self):
+        if self.daemon:
+            if self.launched:
+                self.toggle()
+            self.launched = True
+            return
+        self.want_picker = True
+        self.start_scan()
+        if self.images:
+            self.show_picker()
+
+    def toggle(self):
+        if self.win is not None and self.win.get_visible():
+            self.win.close_picker()
+        else:
+            self.want_picker = True
+            self.show_picker()
+
+    def start_scan(self):
+        """Nạp index đã lưu rồi kiểm tra lại ở background (chỉ một lần mỗi process)"""
+        if self.index is not None:
+            return
         if not WALL_DIR.exists():
             print(f"[wallpicker] Folder not found: {WALL_DIR}", file=sys.stderr); sys.exit(1)
-        images = list_images(WALL_DIR)
+        with TRACE.span("index_load"):
+            self.index = WallIndex(WALL_DIR)
+            self.images = self.index.cached_images()
+        TRACE.mark("index_loaded")
+        if self.images and self.daemon:
+            self.build_picker()
+        self.hold()
+        threading.Thread(target=self.scan_worker, args=(self.index, bool(self.images)), daemon=True).start()
+
+    def build_picker(self):
+        """Tạo cửa sổ (chưa hiện) để daemon load sẵn thumbnail trang đầu"""
+        self.win = RadialPicker(self, self.images, self.index, resident=self.daemon, decoder=self.decoder)
+        self.win.connect("destroy", self.on_picker_destroy)
+
+    def show_picker(self):
+        if not self.images:
+            return   # hiện khi scan_worker gửi lô ảnh đầu tiên
+        if self.win is None:
+            self.build_picker()
+        self.want_picker = False
+        self.win.present()
+        TRACE.mark("window_presented")
+        self.win.area.grab_focus()
+
+    def on_picker_destroy(self, win):
+        self.win = None
+        self.want_picker = False
+
+    def scan_worker(self, index, warm):
+        """Quét (tăng dần) thư mục ảnh; lần đầu stream theo lô để trang đầu hiện sớm"""
+        found = []
+        next_emit = LAYOUT.page_size
+        with TRACE.span("index_walk"):
+            for path in index.walk():
+                found.append(path)
+                if not warm and len(found) >= next_emit:
+                    GLib.idle_add(self.on_scan_batch, list(found), False)
+                    next_emit = len(found) + 512
+        TRACE.event("scan_done", f"Indexed {len(found)} images", count=len(found))
+        GLib.idle_add(self.on_scan_batch, found, True)
+
+    def on_scan_batch(self, images, done):
+        if done:
+            self.release()
+            if images and self.watcher is None:
+                self.watcher = WallWatcher(self.index, self.on_library_changed)
         if not images:
-            print(f"[wallpicker] No images in {WALL_DIR}", file=sys.stderr); sys.exit(1)
-        win = RadialPicker(self, images)
-        win.present()
+            if done:
+                print(f"[wallpicker] No images in {WALL_DIR}", file=sys.stderr)
+                if self.win is None and not self.daemon:
+                    self.quit()
+            return False
+        self.images = images
+        if self.win is not None:
+            if images != self.win.library:
+                self.win.set_images(images)
+        elif self.want_picker:
+            self.show_picker()
+        elif self.daemon:
+            self.build_picker()
+        return False
+
+    def on_library_changed(self, added, removed):
+        if self.win is not None:
+            self.win.on_library_changed(added, removed)
+            self.images = self.win.library
+        else:
+            self.images = merge_changes(self.images, added, removed)
+
+# ---- Batch: --warm-cache ----
+def warm_one(path, target, stat):
+    """Tạo thumbnail vào cache đĩa (chạy trong worker)"""
+    return load_single_image(path, target, stat=stat) is not None
+
+def warm_cache(folder: Path, backend="process"):
+    """Quét folder và tạo sẵn mọi thumbnail picker sẽ cần rồi thoát.
+
+    Tăng dần: ảnh có (mtime, size) không đổi thì key cache đã tồn tại và được bỏ qua.
+    Có flock nên chạy song song (systemd timer, sau wall-random.sh...) không giẫm nhau."""
+    if not folder.is_dir():
+        print(f"[wallpicker] Folder not found: {folder}", file=sys.stderr)
+        return 1
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    lock = open(CACHE_DIR / "warm-cache.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        TRACE.event("warm_busy", "Another --warm-cache run is active, exiting")
+        return 0
+    try:
+        os.nice(10)   # chạy nền, nhường CPU cho phiên làm việc
+    except OSError:
+        pass
+
+    with TRACE.span("index_walk"):
+        index = WallIndex(folder)
+        images = list(index.walk())
+    jobs = []
+    skipped = 0
+    cached_bytes = 0
+    page_size = LAYOUT.page_size
+    for start in range(0, len(images), page_size):
+        page = images[start:start + page_size]
+        for path, target in zip(page, page_thumb_targets(len(page))):
+            stat = index.stat(path)
+            # lookup() chạm mtime: thumbnail đã có thành mới nhất, không bị LRU xoá khi ghi bản mới
+            f = THUMBS.lookup(THUMBS.key(path, *stat, target)) if stat else None
+            if f is not None:
+                skipped += 1
+                try:
+                    cached_bytes += f.stat().st_size
+                except OSError:
+                    pass
+            else:
+                jobs.append((path, target, stat))
+    TRACE.event("warm_plan", f"{len(images)} images, {skipped} cached, {len(jobs)} to generate",
+                images=len(images), skipped=skipped, todo=len(jobs))
+
+    # Vượt giới hạn cache thì lượt warm tự xoá chính kết quả của nó (và lần sau lại tạo lại):
+    # chỉ tạo phần vừa với dung lượng còn lại, theo thứ tự thư viện (trang đầu trước)
+    per_thumb = cached_bytes / skipped if skipped else None
+    needed = cached_bytes
+    fits = None
+    for i, (_, target, _) in enumerate(jobs):
+        if per_thumb is None:
+            tw, th = target if isinstance(target, tuple) else (target, target)
+            needed += tw * th * WARM_BYTES_PER_PIXEL
+        else:
+            needed += per_thumb
+        if fits is None and needed > THUMBS.max_bytes:
+            fits = i
+    if fits is not None:
+        need_mb = math.ceil(needed / 1024 / 1024)
+        print(f"[wallpicker] thumbnail cache limit {THUMB_CACHE_MB} MB is too small for this library "
+              f"(~{need_mb} MB needed); generating {fits}/{len(jobs)}. Raise WALLPICKER_CACHE_MB to cache all.",
+              file=sys.stderr)
+        TRACE.event("warm_over_budget", None, limit_mb=THUMB_CACHE_MB, need_mb=need_mb, fits=fits, todo=len(jobs))
+        jobs = jobs[:fits]
+
+    done = failed = 0
+    if jobs:
+        if backend == "process":
+            pool = ProcessPoolExecutor(os.cpu_count() or 4, mp_context=get_context("forkserver"))
+        else:
+            pool = ThreadPoolExecutor(4)
+        with pool, TRACE.span("warm_generate"):
+            paths, targets, stats = zip(*jobs)
+            for ok in pool.map(warm_one, paths, targets, stats, chunksize=8):
+                done += 1
+                failed += not ok
+                if done % 100 == 0 or done == len(jobs):
+                    TRACE.event("warm_progress", f"Generated {done}/{len(jobs)}", done=done, total=len(jobs))
+    TRACE.event("warm_done", f"Warm cache done: {done - failed} generated, {skipped} skipped, {failed} failed",
+                generated=done - failed, skipped=skipped, failed=failed)
+    if np is not None:
+        # pHash + màu chủ đạo đọc từ thumbnail vừa tạo, để picker bật chế độ bỏ trùng / theo màu ngay
+        features = FeatureIndex(folder)
+        with TRACE.span("warm_features"):
+            entries = features.compute(images, index.stat)
+        if entries:
+            features.merge(entries)
+    return 0
+
+# ---- Batch: --apply ----
+def apply_once(path: Path):
+    """Đặt wallpaper không cần cửa sổ (wall-random.sh dùng); trả về mã thoát"""
+    if not path.is_file():
+        print(f"[wallpicker] File not found: {path}", file=sys.stderr)
+        return 1
+    loop = GLib.MainLoop()
+    errors = []
+
+    def done(error):
+        errors.append(error)
+        loop.quit()
+    WallpaperSetter(on_done=done).apply(path)
+    loop.run()
+    return 0 if errors and errors[0] is None else 1
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Radial wallpaper picker")
+    parser.add_argument("--daemon", action="store_true",
+                        help="chạy thường trú, mỗi lần activate (chạy lại / action toggle) thì bật/tắt picker")
+    parser.add_argument("--profile", action="store_true",
+                        help="đo thời gian khởi động, decode, vẽ; in JSON ra stderr khi thoát")
+    parser.add_argument("--backend", choices=("thread", "process"), default=None,
+                        help="decode trong luồng (mặc định) hay process pool theo số core")
+    parser.add_argument("--warm-cache", nargs="?", const=str(WALL_DIR), metavar="DIR",
+                        help="tạo sẵn thumbnail (và pHash/màu nếu có NumPy) cho DIR (mặc định WALL_DIR) rồi thoát; dùng process pool nếu không chỉ định --backend")
+    parser.add_argument("--apply", metavar="PATH",
+                        help="đặt PATH làm wallpaper (bản scale sẵn theo từng màn hình) rồi thoát, không mở picker")
+    parser.add_argument("--sectors", type=int, metavar="N",
+                        help=f"số miếng của vòng trong cùng (mặc định {PAGE_SIZE}, env WALLPICKER_SECTORS)")
+    parser.add_argument("--rings", type=int, metavar="N",
+                        help=f"số vòng đồng tâm mỗi trang, vòng ngoài nhiều miếng hơn (mặc định {RINGS}, env WALLPICKER_RINGS)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="tắt log tiến trình")
+    return parser.parse_args()
 
 def main():
-    app = App()
-    app.run()
+    arguments = parse_arguments()
+    TRACE.profile = arguments.profile
+    TRACE.verbose = not arguments.quiet
+    TRACE.mark("args")
+    LAYOUT.configure(arguments.sectors, arguments.rings)
+    if arguments.apply:
+        status = apply_once(Path(arguments.apply))
+        TRACE.dump()
+        return status
+    if arguments.warm_cache:
+        status = warm_cache(Path(arguments.warm_cache), arguments.backend or "process")
+        TRACE.dump()
+        return status
+    app = App(daemon=arguments.daemon, backend=arguments.backend or DECODE_BACKEND)
+    if arguments.profile:
+        # Daemon chỉ thoát bằng signal: quit() để vẫn in được số liệu
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, sig, app.quit)
+    # argv đã xử lý ở trên, GApplication không cần thấy các option riêng
+    status = app.run(sys.argv[:1])
+    TRACE.dump()
+    return status
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
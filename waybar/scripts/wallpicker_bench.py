@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+"""Benchmark headless cho wallpicker.py (không cần display).
+
+    wallpicker_bench.py gen  /tmp/wallbench --files 5000
+    wallpicker_bench.py run  /tmp/wallbench [--json out.json] [--baseline old.json]
+
+`gen` tạo corpus ảnh giả (JPEG/PNG/WebP ở 1080p/4K/8K, thư mục lồng nhau); các file
+là hard link tới vài ảnh gốc (để trong DIR.masters) nên 50k file vẫn không tốn dung
+lượng, nhưng path khác nhau nên picker vẫn phải decode và cache từng file.
+
+`run` chạy mỗi phase trong một process riêng (để đo peak RSS và cache lạnh/ấm):
+  decode                 decode-at-size + ghi cache trống, theo backend (--backend thread|process)
+  open_cold / open_warm  index + decode đủ trang đầu qua ImageLoader
+  render                 RingRenderer + HUD của RadialPicker trên cairo.ImageSurface
+"cold" là cache của wallpicker trống (page cache của kernel không bị xoá).
+"""
+import argparse, json, os, resource, shutil, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+RESOLUTIONS = {"1080p": (1920, 1080), "4k": (3840, 2160), "8k": (7680, 4320)}
+FORMATS = {"jpg": "jpeg", "png": "png", "webp": "webp"}
+
+def import_wallpicker():
+    sys.path.insert(0, str(SCRIPT_DIR))
+    import wallpicker
+    wallpicker.TRACE.verbose = False
+    return wallpicker
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def stats_ms(values):
+    v = sorted(values)
+    return {"mean_ms": round(sum(v) / len(v), 3), "p95_ms": round(v[min(len(v) - 1, int(len(v) * 0.95))], 3),
+            "max_ms": round(v[-1], 3)}
+
+# ---- Corpus ----
+def gen_corpus(args):
+    import gi
+    gi.require_version("GdkPixbuf", "2.0")
+    from gi.repository import GdkPixbuf, GLib
+
+    root = Path(args.dir)
+    writable = {f.get_name() for f in GdkPixbuf.Pixbuf.get_formats() if f.is_writable()}
+    masters = []
+    master_dir = root.with_name(root.name + ".masters")   # ngoài root để không bị index
+    master_dir.mkdir(parents=True, exist_ok=True)
+    for res in args.resolutions.split(","):
+        w, h = RESOLUTIONS[res]
+        for ext in args.formats.split(","):
+            fmt = FORMATS[ext]
+            if fmt not in writable:
+                print(f"[bench] gdk-pixbuf cannot write {fmt}, skipping", file=sys.stderr)
+                continue
+            out = master_dir / f"{res}.{ext}"
+            if not out.exists():
+                # Nhiễu 64x36 phóng lên: có gradient như ảnh thật, không nén quá dễ
+                small = GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(os.urandom(64 * 36 * 3)),
+                                                        GdkPixbuf.Colorspace.RGB, False, 8, 64, 36, 64 * 3)
+                big = small.scale_simple(w, h, GdkPixbuf.InterpType.BILINEAR)
+                opts = (["quality"], ["90"]) if fmt == "jpeg" else ([], [])
+                big.savev(str(out), fmt, *opts)
+            masters.append(out)
+    if not masters:
+        sys.exit("[bench] no writable formats")
+
+    per_dir = args.per_dir
+    for i in range(args.files):
+        d = root / f"d{i // (per_dir * per_dir):03d}" / f"d{(i // per_dir) % per_dir:03d}"
+        src = masters[i % len(masters)]
+        dst = d / f"wall{i:06d}{src.suffix}"
+        if dst.exists():
+            continue
+        d.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copyfile(src, dst)
+    print(f"[bench] {args.files} files from {len(masters)} masters in {root}")
+
+# ---- Phases (chạy trong process con) ----
+def phase_open(wp, root, n_decode):
+    from gi.repository import GLib
+    t0 = time.perf_counter()
+    index = wp.WallIndex(root)
+    images = index.cached_images()
+    first_page = threading.Event()
+    result = {"index_cached": bool(images)}
+    if images:
+        first_page.set()
+        t_list = time.perf_counter()
+    # Giống App.scan_worker: walk chạy nền, trang đầu có là dùng ngay
+    found = []
+    def walk():
+        t = time.perf_counter()
+        for path in index.walk():
+            found.append(path)
+            if len(found) == wp.LAYOUT.page_size:
+                first_page.set()
+        result["index_walk_ms"] = round((time.perf_counter() - t) * 1000, 2)
+        result["images"] = len(found)
+        first_page.set()
+    walker = threading.Thread(target=walk)
+    walker.start()
+    first_page.wait()
+    if not images:
+        t_list = time.perf_counter()
+        images = list(found[:wp.LAYOUT.page_size])
+    result["first_page_list_ms"] = round((t_list - t0) * 1000, 2)
+
+    page = images[:wp.LAYOUT.page_size]
+    targets = wp.page_thumb_targets(len(page))
+    loop = GLib.MainLoop()
+    loader = wp.ImageLoader(stat_of=index.stat)
+    gen = loader.new_generation()
+    pending = set(range(len(page)))
+
+    def on_loaded(gen, i, path, target, pixbuf):
+        pending.discard(i)
+        if not pending:
+            loop.quit()
+        return False
+
+    for i, (path, target) in enumerate(zip(page, targets)):
+        loader.submit(gen, (loader.PRIO_VISIBLE, i), path, target, on_loaded, i)
+    if pending:
+        loop.run()
+    result["first_full_page_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    walker.join()
+    return result
+
+def phase_decode(wp, root, n_decode):
+    index = wp.WallIndex(root)
+    images = index.cached_images() or list(index.walk())
+    step = max(1, len(images) // n_decode)
+    sample = images[::step][:n_decode]
+    target = wp.page_thumb_targets(wp.LAYOUT.page_size)[0]   # vòng trong cùng
+    per_image = []
+    decoder = wp.make_decoder()   # theo WALLPICKER_BACKEND; chạy đầu tiên nên cache thumbnail còn trống
+
+    def decode(path):
+        t = time.perf_counter()
+        decoder.decode(path, target)
+        per_image.append((time.perf_counter() - t) * 1000)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=decoder.workers) as pool:
+        list(pool.map(decode, sample))
+    elapsed = time.perf_counter() - t0
+    return {"backend": wp.DECODE_BACKEND, "workers": decoder.workers, "decoded": len(sample),
+            "decodes_per_s": round(len(sample) / elapsed, 2), "decode": stats_ms(per_image)}
+
+def phase_render(wp, root, n_decode, frames=200):
+    import cairo
+    index = wp.WallIndex(root)
+    images = (index.cached_images() or list(index.walk()))[:wp.LAYOUT.page_size]
+    n = len(images)
+    pixbufs = [wp.load_single_image(p, t) for p, t in zip(images, wp.page_thumb_targets(n))]
+    size = wp.SIZE
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, size, size)
+    renderer = wp.RingRenderer()
+
+    full = []
+    for _ in range(max(1, frames // 10)):
+        renderer.invalidate()
+        t = time.perf_counter()
+        renderer.ring(size, size, n, pixbufs)
+        full.append((time.perf_counter() - t) * 1000)
+
+    hover = []
+    for f in range(frames):
+        t = time.perf_counter()
+        cr = cairo.Context(surface)
+        ring = renderer.ring(size, size, n, pixbufs)
+        cr.set_source_surface(ring, 0, 0)
+        cr.paint()
+        renderer.draw_hover(cr, f % n)
+        surface.flush()
+        hover.append((time.perf_counter() - t) * 1000)
+
+    # HUD của RadialPicker (page indicator) vẽ trên HudState, không cần cửa sổ
+    state = wp.HudState(current_page=1, total_pages=3)
+    hud = []
+    for _ in range(frames):
+        t = time.perf_counter()
+        cr = cairo.Context(surface)
+        state.draw(cr, size, size)
+        surface.flush()
+        hud.append((time.perf_counter() - t) * 1000)
+    return {"ring_full": stats_ms(full), "hover_frame": stats_ms(hover), "hud_frame": stats_ms(hud)}
+
+PHASES = {"open_cold": phase_open, "open_warm": phase_open, "decode": phase_decode, "render": phase_render}
+
+def run_phase(args):
+    wp = import_wallpicker()
+    result = PHASES[args.phase](wp, Path(args.dir), args.decode_sample)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    json.dump(result, sys.stdout)
+
+# ---- Orchestrator ----
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[f"{prefix}{k}"] = v
+    return out
+
+def compare(report, baseline, tolerance):
+    """Trả về danh sách metric tệ hơn baseline quá tolerance"""
+    cur, old = flatten(report), flatten(baseline)
+    worse = []
+    for key, value in cur.items():
+        if key not in old or not old[key]:
+            continue
+        if key.endswith("_ms") or key.endswith("_mb"):
+            ratio = value / old[key]
+        elif key.endswith("_per_s"):
+            ratio = old[key] / value if value else float("inf")
+        else:
+            continue
+        if ratio > 1 + tolerance:
+            worse.append((key, old[key], value))
+    return worse
+
+def run_all(args):
+    cache = Path(tempfile.mkdtemp(prefix="wallbench-cache-"))
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache))
+    if args.backend:
+        env["WALLPICKER_BACKEND"] = args.backend
+    report = {"dir": str(args.dir)}
+    try:
+        for phase in ("decode", "open_cold", "open_warm", "render"):
+            if phase == "open_cold":
+                shutil.rmtree(cache / "wallpicker", ignore_errors=True)
+            out = subprocess.run([sys.executable, __file__, "_phase", phase, str(args.dir),
+                                  "--decode-sample", str(args.decode_sample)],
+                                 env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+            report[phase] = json.loads(out)
+            print(f"[bench] {phase}: {report[phase]}", file=sys.stderr)
+    finally:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    else:
+        print(json.dumps(report, indent=2))
+    if args.baseline:
+        worse = compare(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for key, old, new in worse:
+            print(f"[bench] REGRESSION {key}: {old} -> {new}", file=sys.stderr)
+        return 1 if worse else 0
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless benchmark for wallpicker.py")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("gen", help="tạo corpus ảnh giả")
+    g.add_argument("dir")
+    g.add_argument("--files", type=int, default=1000, help="số file (100 .. 50000)")
+    g.add_argument("--resolutions", default="1080p,4k,8k")
+    g.add_argument("--formats", default="jpg,png,webp")
+    g.add_argument("--per-dir", type=int, default=100, help="số file / số thư mục con mỗi cấp")
+
+    r = sub.add_parser("run", help="chạy benchmark")
+    r.add_argument("dir")
+    r.add_argument("--decode-sample", type=int, default=48)
+    r.add_argument("--json", help="ghi report ra file thay vì stdout")
+    r.add_argument("--baseline", help="report cũ để so sánh, thoát 1 nếu chậm hơn")
+    r.add_argument("--tolerance", type=float, default=0.2)
+    r.add_argument("--backend", choices=("thread", "process"), help="decode backend (WALLPICKER_BACKEND)")
+
+    p = sub.add_parser("_phase")   # dùng nội bộ
+    p.add_argument("phase", choices=PHASES)
+    p.add_argument("dir")
+    p.add_argument("--decode-sample", type=int, default=48)
+
+    args = parser.parse_args()
+    if args.cmd == "gen":
+        return gen_corpus(args)
+    if args.cmd == "run":
+        return run_all(args)
+    return run_phase(args)
+
+if __name__ == "__main__":
+    sys.exit(main())